@@ -0,0 +1,246 @@
+'''
+Benchmarks for the model building pipeline.
+
+    python3 benchmarks.py --sizes 1000 10000 100000
+    python3 benchmarks.py --templates
+
+Each size writes a synthetic HYG-shaped csv, then times and
+memory-profiles every stage of a build on it: ingest (hyg-loader.py
+into sqlite), load (load_stars_from_sqlite of the largest
+constellation), project, scale (the stacked model's get_star_scalar)
+and write (the stacked model's write_vrml).  Results are appended to
+a json history so runs can be compared across commits and machines.
+
+Memory is the tracemalloc peak of the stage, which slows the stage
+down, --no-memory times without it.
+'''
+
+import argparse
+import contextlib
+import csv
+import datetime
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+from string import Template
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from constellation import Constellation
+from star_catalog import close_catalogs
+from vrml_model import ConstellationStackedModel, ModelConfig
+import vrml_templates
+
+hyg_loader = importlib.import_module('hyg-loader')
+
+CONFIG = {
+    'history': "../build/benchmarks.json",
+    'sizes': [1000, 10000, 100000],
+    'constellations': 88,
+    # relative constellation sizes fall off as 1 / rank ** skew,
+    # 0 is every constellation the same size
+    'constellation_skew': 0,
+    # star counts grow 10 ** (magnitude_slope * m) up to max_magnitude
+    'magnitude_slope': .5,
+    'max_magnitude': 12,
+    'designated_fraction': .5,
+    'load_magnitude': 12,
+    'connections': 25,
+    'seed': 1
+}
+
+
+def constellation_names(count):
+    return ['C{:02d}'.format(i) for i in range(count)]
+
+
+def synthetic_stars(count, config, rng):
+    '''
+    Column arrays for count HYG-shaped stars, uniform over the sphere.
+    '''
+    names = constellation_names(config['constellations'])
+    weights = 1 / np.arange(1, len(names) + 1) ** config['constellation_skew']
+
+    # inverse cdf of the 10 ** (slope * m) counts below max_magnitude
+    slope = config['magnitude_slope'] * np.log(10)
+    magnitude = config['max_magnitude'] + np.log(rng.uniform(size=count)) / slope
+    designated = rng.uniform(size=count) < config['designated_fraction']
+
+    return {
+        'id': np.arange(1, count + 1),
+        'ra': rng.uniform(0, 24, count),
+        'dec': np.degrees(np.arcsin(rng.uniform(-1, 1, count))),
+        'dist': rng.uniform(1, 1000, count),
+        'mag': magnitude,
+        'con': rng.choice(names, count, p=weights / weights.sum()),
+        'bf': np.where(designated, 'Syn', '')
+    }
+
+
+def write_synthetic_csv(csv_file, count, config=CONFIG):
+    '''
+    Write a csv with the columns hyg-loader.py reads, columns with no
+    synthetic values are left empty like the sparse HYG columns.
+    '''
+    rng = np.random.RandomState(config['seed'])
+    stars = synthetic_stars(count, config, rng)
+    header = [c[0] for c in hyg_loader.STAR_COLUMNS]
+    empty = [''] * count
+    columns = [stars[c].tolist() if c in stars else empty for c in header]
+    with open(csv_file, 'w', newline='') as csv_fh:
+        writer = csv.writer(csv_fh)
+        writer.writerow(header)
+        writer.writerows(zip(*columns))
+    names, counts = np.unique(stars['con'], return_counts=True)
+    return names[np.argmax(counts)]
+
+
+def run_stage(stage, memory=True):
+    '''
+    Run stage() quietly, returns its result, seconds and the peak
+    traced memory in bytes (None without memory).
+    '''
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = stage()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_pipeline(size, config=CONFIG, memory=True):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_config = dict(hyg_loader.CONFIG,
+                         src_csv=os.path.join(tmp_dir, 'stars.csv'),
+                         sqlite_db=os.path.join(tmp_dir, 'stars.db'))
+        abbreviation = write_synthetic_csv(db_config['src_csv'], size, config)
+        con = Constellation(abbreviation, db_config,
+                            mag=config['load_magnitude'])
+        model = ConstellationStackedModel(con, ModelConfig())
+        model.configure()
+        model.output_filename = os.path.join(tmp_dir, 'stars.wrl')
+
+        def load():
+            con.load_stars_from_sqlite(db_config['sqlite_db'])
+            ids = con.stars.ids[:config['connections'] + 1].tolist()
+            con.set_connections(list(zip(ids, ids[1:])))
+
+        stages = [('ingest', lambda: hyg_loader.load_stars(db_config)),
+                  ('load', load),
+                  ('project', con.project),
+                  ('scale', model.get_star_scalar),
+                  ('write', model.build_vrml)]
+        results = {}
+        for name, stage in stages:
+            _, seconds, peak = run_stage(stage, memory)
+            results[name] = {'seconds': seconds, 'peak_bytes': peak}
+
+        results['load']['stars'] = len(con.stars)
+        results['write']['bytes'] = os.path.getsize(model.output_filename)
+        return results
+    finally:
+        close_catalogs()
+        shutil.rmtree(tmp_dir)
+
+
+def print_results(size, results):
+    print("{} stars".format(size))
+    for name, result in results.items():
+        peak = result['peak_bytes']
+        print("  {:8} {:9.3f}s {:>10}".format(
+            name, result['seconds'],
+            '' if peak is None else '{:.1f} MiB'.format(peak / 2 ** 20)))
+
+
+def append_history(history_file, run):
+    history = []
+    if os.path.exists(history_file):
+        with open(history_file) as history_fh:
+            history = json.load(history_fh)
+    history.append(run)
+    os.makedirs(os.path.dirname(os.path.abspath(history_file)), exist_ok=True)
+    with open(history_file, 'w') as history_fh:
+        json.dump(history, history_fh, indent=1)
+
+
+def bench_sizes(sizes, config=CONFIG, memory=True):
+    run = {'when': datetime.datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'numpy': np.__version__,
+           'machine': platform.machine(),
+           'processor': platform.processor(),
+           'config': config,
+           'memory': memory,
+           'sizes': {}}
+    for size in sizes:
+        results = bench_pipeline(size, config, memory)
+        print_results(size, results)
+        run['sizes'][str(size)] = results
+    append_history(config['history'], run)
+    return run
+
+
+def bench_templates(count=20000, repeat=3):
+    '''
+    Per-element cost of rendering StarSphere through string.Template,
+    as the models used to, against the precompiled template.
+    '''
+    values = [{'x': i * .37, 'y': i * 1.3, 'z': -i * .11, 'radius': 3}
+              for i in range(count)]
+
+    def per_element(render):
+        best = min(timeit.repeat(lambda: [render(v) for v in values],
+                                 number=1, repeat=repeat))
+        return best / count * 1e6
+
+    parsed = per_element(
+        lambda v: Template(vrml_templates.StarSphere).substitute(**v))
+    compiled = per_element(
+        lambda v: vrml_templates.StarSphereTemplate.substitute(**v))
+
+    print("StarSphere render, {} elements".format(count))
+    print("  string.Template: {:8.2f} us/element".format(parsed))
+    print("  compiled:        {:8.2f} us/element".format(compiled))
+    print("  speedup:         {:8.1f}x".format(parsed / compiled))
+    return {'template_us': parsed, 'compiled_us': compiled}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the build pipeline on synthetic catalogs')
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=CONFIG['sizes'])
+    parser.add_argument('--constellations', type=int,
+                        default=CONFIG['constellations'])
+    parser.add_argument('--constellation-skew', type=float,
+                        default=CONFIG['constellation_skew'])
+    parser.add_argument('--magnitude-slope', type=float,
+                        default=CONFIG['magnitude_slope'])
+    parser.add_argument('--history', default=CONFIG['history'])
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip tracemalloc, for undisturbed timings')
+    parser.add_argument('--templates', action='store_true',
+                        help='run the template micro-benchmark instead')
+    args = parser.parse_args()
+
+    if args.templates:
+        bench_templates()
+    else:
+        CONFIG.update(constellations=args.constellations,
+                      constellation_skew=args.constellation_skew,
+                      magnitude_slope=args.magnitude_slope,
+                      history=args.history)
+        bench_sizes(args.sizes, CONFIG, memory=not args.no_memory)
@@ -0,0 +1,148 @@
+'''
+A columnar, memory-mappable copy of the stars table.
+
+stars.npy holds the columns the models use as one fixed-dtype record
+per star, sorted by constellation then magnitude (missing magnitudes
+last).  constellations.npy maps each abbreviation to its [start, stop)
+rows, and id_index.npy is (id, row) sorted by id for selection loads.
+'''
+
+import os
+
+import numpy as np
+
+STARS_FILE = 'stars.npy'
+CONSTELLATIONS_FILE = 'constellations.npy'
+ID_INDEX_FILE = 'id_index.npy'
+
+ID_INDEX_DTYPE = np.dtype([('id', np.int64), ('row', np.int64)])
+
+
+def star_dtype(designation_len, proper_name_len):
+    return np.dtype([('id', np.int64),
+                     ('ra', np.float64),
+                     ('dec', np.float64),
+                     ('distance', np.float64),
+                     ('magnitude', np.float64),
+                     ('designation', 'S{}'.format(max(designation_len, 1))),
+                     ('proper_name', 'S{}'.format(max(proper_name_len, 1)))])
+
+
+def write_binary_catalog(star_conn, out_dir, batch_size=10000):
+    '''
+    Write the binary catalog for the stars table of an open sqlite
+    connection, streaming rows into the memory-mapped output.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    count, designation_len, proper_name_len, abbreviation_len = \
+        star_conn.execute('''
+        SELECT COUNT(*),
+        IFNULL(MAX(LENGTH(CAST(bayer_flamsteed_designation AS BLOB))), 0),
+        IFNULL(MAX(LENGTH(CAST(proper_name AS BLOB))), 0),
+        IFNULL(MAX(LENGTH(CAST(constellation AS BLOB))), 0)
+        FROM stars''').fetchone()
+
+    stars = np.lib.format.open_memmap(
+        os.path.join(out_dir, STARS_FILE), mode='w+',
+        dtype=star_dtype(designation_len, proper_name_len), shape=(count,))
+
+    cursor = star_conn.execute('''
+        SELECT
+        id, ra, dec, distance, magnitude,
+        IFNULL(bayer_flamsteed_designation, ''),
+        IFNULL(proper_name, '')
+        FROM stars
+        ORDER BY constellation, magnitude IS NULL, magnitude, id''')
+
+    row = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        batch = stars[row:row + len(rows)]
+        for i, name in enumerate(('id', 'ra', 'dec', 'distance',
+                                  'magnitude')):
+            batch[name] = np.array([r[i] for r in rows],
+                                   dtype=batch.dtype[name])
+        batch['designation'] = [r[5].encode() for r in rows]
+        batch['proper_name'] = [r[6].encode() for r in rows]
+        row += len(rows)
+    stars.flush()
+
+    # groups come back in the same constellation order as the rows
+    groups = star_conn.execute('''
+        SELECT IFNULL(constellation, ''), COUNT(*) FROM stars
+        GROUP BY constellation ORDER BY constellation''').fetchall()
+    offsets = np.zeros(len(groups), dtype=[
+        ('abbreviation', 'S{}'.format(max(abbreviation_len, 1))),
+        ('start', np.int64), ('stop', np.int64)])
+    offsets['abbreviation'] = [g[0].encode() for g in groups]
+    offsets['stop'] = np.cumsum([g[1] for g in groups])
+    offsets['start'][1:] = offsets['stop'][:-1]
+    np.save(os.path.join(out_dir, CONSTELLATIONS_FILE), offsets)
+
+    id_index = np.empty(count, dtype=ID_INDEX_DTYPE)
+    id_index['id'] = stars['id']
+    id_index['row'] = np.arange(count)
+    id_index.sort(order='id')
+    np.save(os.path.join(out_dir, ID_INDEX_FILE), id_index)
+    del stars
+    return count
+
+
+class BinaryCatalog(object):
+    '''
+    Read side of the binary catalog, the star records stay memory
+    mapped and constellation loads are slices of them.
+    '''
+
+    def __init__(self, catalog_dir):
+        self.catalog_dir = catalog_dir
+        self.stars = np.load(os.path.join(catalog_dir, STARS_FILE),
+                             mmap_mode='r')
+        self.id_index = np.load(os.path.join(catalog_dir, ID_INDEX_FILE),
+                                mmap_mode='r')
+        offsets = np.load(os.path.join(catalog_dir, CONSTELLATIONS_FILE))
+        self.offsets = {o['abbreviation'].decode(): (int(o['start']),
+                                                     int(o['stop']))
+                        for o in offsets}
+
+    def constellation(self, abbreviation, magnitude=None):
+        '''
+        The records of one constellation, brighter than magnitude if
+        given, as a view onto the mapped file.
+        '''
+        start, stop = self.offsets.get(abbreviation, (0, 0))
+        records = self.stars[start:stop]
+        if magnitude is not None:
+            cut = np.searchsorted(records['magnitude'], magnitude, 'left')
+            records = records[:cut]
+        return records
+
+    def select(self, ids):
+        '''
+        The records for a list of ids, in id order, unknown ids skipped.
+        '''
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        index_ids = self.id_index['id']
+        if not len(index_ids):
+            return self.stars[:0]
+        found = np.minimum(np.searchsorted(index_ids, ids), len(index_ids) - 1)
+        found = found[index_ids[found] == ids]
+        return self.stars[self.id_index['row'][found]]
+
+
+_binary_catalogs = {}
+
+
+def open_binary_catalog(catalog):
+    '''
+    Return the shared BinaryCatalog for a directory, catalog may
+    already be a BinaryCatalog.
+    '''
+    if isinstance(catalog, BinaryCatalog):
+        return catalog
+    key = os.path.abspath(catalog)
+    if key not in _binary_catalogs:
+        _binary_catalogs[key] = BinaryCatalog(key)
+    return _binary_catalogs[key]
@@ -0,0 +1,132 @@
+'''
+An on-disk cache for builds, keyed by hashes of their inputs.
+
+Two things are cached.  The projected star table of a constellation,
+keyed by the catalog version, abbreviation, magnitude filter and
+selection, so rendering option changes skip sqlite and projection.
+And each finished output file, keyed by the star table key plus the
+build, connections, ModelConfig values and any other options, so an
+unchanged build is a file copy.
+
+The catalog version is the db path, size and mtime, re-running
+hyg-loader.py changes it.  Bump CACHE_VERSION when model or template
+code changes what a build writes.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from indicies import *
+from star_catalog import StarCatalog
+
+CACHE_VERSION = 1
+
+
+def input_hash(*parts):
+    '''
+    sha256 of the json of parts, dict keys sorted so equal inputs
+    always hash the same.
+    '''
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def catalog_version(star_db):
+    if isinstance(star_db, StarCatalog):
+        star_db = star_db.db_file
+    path = os.path.abspath(star_db)
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _replace(dest, write):
+    '''
+    Write to a temporary file then rename it over dest, parallel
+    builds never see a partial cache entry.
+    '''
+    tmp = '{}.{}.tmp'.format(dest, os.getpid())
+    try:
+        write(tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class BuildCache(object):
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_dir, '{}.{}'.format(key, extension))
+
+    def stars_key(self, star_db, abbreviation, magnitude, selection=None):
+        return input_hash(CACHE_VERSION, catalog_version(star_db),
+                          abbreviation, magnitude,
+                          sorted(selection) if selection else None)
+
+    def output_key(self, stars_key, build, connections, model_config=None,
+                   **options):
+        return input_hash(CACHE_VERSION, stars_key, build,
+                          [list(c) for c in connections],
+                          vars(model_config) if model_config else None,
+                          options)
+
+    def has_stars(self, key):
+        return os.path.exists(self._path(key, 'npz'))
+
+    def load_stars(self, key, constellation):
+        '''
+        Fill an empty constellation's star table, projected, from the
+        cache. Returns False on a miss.
+        '''
+        path = self._path(key, 'npz')
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        with np.load(path) as cached:
+            xyz = cached['xyz']
+            constellation.stars.extend(
+                cached['hyg_id'].tolist(), cached['designation'].tolist(),
+                cached['proper_name'].tolist(), cached['radec'][:, 0],
+                cached['radec'][:, 1], xyz[:, PY], cached['magnitude'])
+        constellation.stars.positions[:] = xyz
+        constellation.stars.touch_positions()
+        self.hits += 1
+        return True
+
+    def store_stars(self, key, constellation):
+        stars = constellation.stars
+
+        def write(tmp):
+            with open(tmp, 'wb') as tmp_file:
+                np.savez(tmp_file, hyg_id=stars.ids, radec=stars.angles,
+                         xyz=stars.positions, magnitude=stars.magnitudes,
+                         designation=np.array(stars.designation, dtype=str),
+                         proper_name=np.array(stars.proper_name, dtype=str))
+
+        _replace(self._path(key, 'npz'), write)
+
+    def fetch_output(self, key, output):
+        '''
+        Copy a cached output to output. Returns False on a miss.
+        '''
+        path = self._path(key, 'out')
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        shutil.copyfile(path, output)
+        self.hits += 1
+        return True
+
+    def store_output(self, key, output):
+        _replace(self._path(key, 'out'),
+                 lambda tmp: shutil.copyfile(output, tmp))
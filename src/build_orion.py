@@ -1,50 +1,155 @@
 
 import subprocess
 
-from constellation import Constellation
+from build_cache import BuildCache
+from constellation import Constellation, load_constellations
 from constellation_chart import ConstellationChart
+from instrumentation import build_report, count, span
+from star_catalog import close_catalogs, open_catalog
 from vrml_model import *
 
 CONFIG = {
-    'star_db': "../data/sc_db/stars.db"
+    'star_db': "../data/sc_db/stars.db",
+    # None turns the build cache off
+    'cache_dir': "../build/cache",
+    # per-build timing reports, json files go to report_dir if set
+    'report': True,
+    'report_dir': None,
+    'profile': False,
+    'trace_memory': False
 }
 
+MAGNITUDE = 5
+
+
+def load_constellation(abr, selection, lines, cache=None, stars_key=None):
+    orion = Constellation(abr, CONFIG, mag=MAGNITUDE)
+    with span('cache'):
+        cached = cache is not None and cache.load_stars(stars_key, orion)
+    if cached:
+        count('cached stars', len(orion.stars))
+    else:
+        orion.load_stars_from_sqlite(open_catalog(CONFIG['star_db']), selection=selection)
+        orion.project()
+        if cache is not None:
+            with span('cache'):
+                cache.store_stars(stars_key, orion)
+    orion.set_connections(lines)
+    return orion
+
+
+def preload_constellations(abbreviations):
+    '''
+    Fill the build cache with the constellation mode stars of many
+    constellations from one pass over the catalog, so their starfield
+    builds don't each query it.
+    '''
+    if not CONFIG.get('cache_dir'):
+        return
+    cache = BuildCache(CONFIG['cache_dir'])
+    keys = {abr: cache.stars_key(CONFIG['star_db'], abr, MAGNITUDE)
+            for abr in abbreviations}
+    missing = [abr for abr, key in keys.items() if not cache.has_stars(key)]
+    if not missing:
+        return
+    loaded = load_constellations(open_catalog(CONFIG['star_db']), missing,
+                                 CONFIG, mag=MAGNITUDE)
+    for abr, constellation in loaded.items():
+        if len(constellation.stars):
+            constellation.project()
+            cache.store_stars(keys[abr], constellation)
+
+
+def cached_build(build, abr, selection, lines, output, render, model_config=None, **options):
+    '''
+    Run render(constellation) to write output, unless the cache has
+    the output for the same inputs already.  A miss still reuses the
+    cached projected stars when only the rendering options changed.
+    Every build gets a timing report, see instrumentation.
+    '''
+    with build_report('{} {}'.format(abr, build), profile=CONFIG.get('profile'),
+                      trace_memory=CONFIG.get('trace_memory'),
+                      report_dir=CONFIG.get('report_dir'),
+                      verbose=CONFIG.get('report')):
+        if not CONFIG.get('cache_dir'):
+            render(load_constellation(abr, selection, lines))
+            return
+
+        cache = BuildCache(CONFIG['cache_dir'])
+        stars_key = cache.stars_key(CONFIG['star_db'], abr, MAGNITUDE, selection)
+        output_key = cache.output_key(stars_key, build, lines, model_config, **options)
+        with span('cache'):
+            cached = cache.fetch_output(output_key, output)
+        if cached:
+            count('cache hits')
+            print("Cached {}".format(output))
+            return
+        render(load_constellation(abr, selection, lines, cache, stars_key))
+        with span('cache'):
+            cache.store_output(output_key, output)
+
+
+def chart_pictogram(abr, orion_points, orion_lines, output="stars.html", view=True):
+    def render(orion):
+        orion_model = ConstellationChart(constellation=orion, featured_stars=orion_points)
+        orion_model.chart2D(output_filename=output, show_chart=False)
+
+    cached_build('pictograph', abr, orion_points, orion_lines, output, render)
+    if view:
+        subprocess.call(["/usr/bin/open", "-a", "Safari", output])
+
+
+def chart_with_starfield(abr, orion_points, orion_lines, output="stars.html", view=True):
+    def render(orion):
+        orion_model = ConstellationChart(constellation=orion, featured_stars=orion_points)
+        orion_model.chart2D(output_filename=output, show_chart=False)
+
+    cached_build('starfield', abr, None, orion_lines, output, render,
+                 featured=sorted(orion_points))
+    if view:
+        subprocess.call(["/usr/bin/open", "-a", "Safari", output])
+
+
+def build_vrml_model(abr, orion_points, orion_lines, output="stars.wrl", view=True):
+    model_config = ModelConfig()
+
+    def render(orion):
+        orion_3d_model = ConstellationStarfieldModel(orion, model_config)
+        orion_3d_model.output_filename = output
+        orion_3d_model.build_vrml()
+
+    cached_build('vrml', abr, orion_points, orion_lines, output, render, model_config)
+    if view:
+        subprocess.call(["/usr/bin/open", output])
+
+
+def build_stacked_model(abr, orion_points, orion_lines, output="stars.wrl", view=True):
+    model_config = ModelConfig()
+
+    def render(orion):
+        orion_3d_model = ConstellationStackedModel(orion, model_config)
+        orion_3d_model.output_filename = output
+        orion_3d_model.build_vrml()
+
+    cached_build('stacked', abr, orion_points, orion_lines, output, render, model_config)
+    if view:
+        subprocess.call(["/usr/bin/open", output])
+
+
+DISPLAYS = {
+    'starfield': chart_with_starfield,
+    'pictograph': chart_pictogram,
+    'vrml': build_vrml_model,
+    'stacked': build_stacked_model
+}
 
-def chart_pictogram(abr, orion_points, orion_lines):
-    orion = Constellation(abr, CONFIG, mag=5)
-    orion.load_stars_from_sqlite(CONFIG['star_db'], selection=orion_points)
-    orion.set_connections(orion_lines)
-    orion.project()
-    orion_model = ConstellationChart(constellation=orion, featured_stars=orion_points)
-    orion_model.chart2D()
-
-
-def chart_with_starfield(abr, orion_points, orion_lines):
-    orion = Constellation(abr, CONFIG, mag=5)
-    orion.load_stars_from_sqlite(CONFIG['star_db'])
-    orion.set_connections(orion_lines)
-    orion.project()
-    orion_model = ConstellationChart(constellation=orion, featured_stars=orion_points)
-    orion_model.chart2D()
-
-
-def build_vrml_model(abr, orion_points, orion_lines):
-    orion = Constellation(abr, CONFIG, mag=5)
-    orion.load_stars_from_sqlite(CONFIG['star_db'], selection=orion_points)
-    orion.set_connections(orion_lines)
-    orion.project()
-    orion_3d_model = ConstellationStarfieldModel(orion, ModelConfig())
-    orion_3d_model.build_vrml()
-    subprocess.call(["/usr/bin/open", "stars.wrl"])
-
-def build_stacked_model(abr, orion_points, orion_lines):
-    orion = Constellation(abr, CONFIG, mag=5)
-    orion.load_stars_from_sqlite(CONFIG['star_db'], selection=orion_points)
-    orion.set_connections(orion_lines)
-    orion.project()
-    orion_3d_model = ConstellationStackedModel(orion, ModelConfig())
-    orion_3d_model.build_vrml()
-    subprocess.call(["/usr/bin/open", "stars.wrl"])
+# output file extension for each display
+DISPLAY_EXTENSIONS = {
+    'starfield': 'html',
+    'pictograph': 'html',
+    'vrml': 'wrl',
+    'stacked': 'wrl'
+}
 
 
 def build_orion():
@@ -60,15 +165,11 @@ def build_orion():
                    (29353, 28966), (29353, 28645), (28966, 27844), (28645, 27844),
                    (25273, 25865)]
 
-    displays = {
-        'starfield': chart_with_starfield,
-        'pictograph': chart_pictogram,
-        'vrml': build_vrml_model,
-        'stacked': build_stacked_model
-    }
-
     build = 'stacked'
-    displays[build](abr, orion_points, orion_lines)
+    try:
+        DISPLAYS[build](abr, orion_points, orion_lines)
+    finally:
+        close_catalogs()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+'''
+Build many constellation figures at once across worker processes.
+
+    python3 build_sky.py --builds stacked vrml --only Ori Cas --workers 4
+
+Figures come from a json list of {"abbreviation", "stars", "lines"},
+every requested build of every figure is one job, and each worker
+process shares one read-only catalog handle between its jobs.
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import time
+
+import build_orion
+from star_catalog import close_catalogs, open_catalog
+
+CONFIG = {
+    'figures': "../data/figures/constellations.json",
+    'out_dir': "../build",
+    'star_db': build_orion.CONFIG['star_db'],
+    'cache_dir': build_orion.CONFIG['cache_dir'],
+    'report_dir': build_orion.CONFIG['report_dir'],
+    'profile': False,
+    'trace_memory': False
+}
+
+# the CONFIG values handed on to build_orion in each worker
+WORKER_SETTINGS = ['star_db', 'cache_dir', 'report_dir', 'profile',
+                   'trace_memory']
+
+
+def load_figures(figures_file, only=None):
+    with open(figures_file) as figures_fh:
+        figures = json.load(figures_fh)
+    if only:
+        figures = [f for f in figures if f['abbreviation'] in only]
+    return figures
+
+
+def init_worker(settings):
+    build_orion.CONFIG.update(settings)
+    open_catalog(settings['star_db'])
+
+
+def run_job(abbreviation, build, stars, lines, output):
+    start = time.perf_counter()
+    build_orion.DISPLAYS[build](abbreviation, stars,
+                                [tuple(line) for line in lines],
+                                output=output, view=False)
+    return abbreviation, build, output, time.perf_counter() - start
+
+
+def build_sky(config, builds, only=None, workers=None):
+    figures = load_figures(config['figures'], only)
+    os.makedirs(config['out_dir'], exist_ok=True)
+
+    start = time.perf_counter()
+    if 'starfield' in builds:
+        # read the catalog once for every starfield, the workers then
+        # find the stars in the build cache
+        build_orion.CONFIG.update({k: config[k] for k in WORKER_SETTINGS})
+        build_orion.preload_constellations(
+            [figure['abbreviation'] for figure in figures])
+        # don't hand the parent's connections to the workers
+        close_catalogs()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=({k: config[k] for k in WORKER_SETTINGS},)) as pool:
+        jobs = {}
+        for figure in figures:
+            for build in builds:
+                output = os.path.join(config['out_dir'], '{}_{}.{}'.format(
+                    figure['abbreviation'], build,
+                    build_orion.DISPLAY_EXTENSIONS[build]))
+                job = pool.submit(run_job, figure['abbreviation'], build,
+                                  figure['stars'], figure['lines'], output)
+                jobs[job] = (figure['abbreviation'], build)
+
+        results = []
+        failed = []
+        for job in as_completed(jobs):
+            # one bad figure shouldn't stop the rest of the sky
+            try:
+                abbreviation, build, output, seconds = job.result()
+            except Exception as e:
+                print("{:4} {:10} failed: {!r}".format(*jobs[job], e))
+                failed.append(jobs[job])
+                continue
+            print("{:4} {:10} {:8.2f}s  {}".format(abbreviation, build,
+                                                   seconds, output))
+            results.append((abbreviation, build, output, seconds))
+
+    print("Built {} outputs in {:.2f}s, {} failed".format(
+        len(results), time.perf_counter() - start, len(failed)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build constellation figures in parallel')
+    parser.add_argument('--figures', default=CONFIG['figures'])
+    parser.add_argument('--out-dir', default=CONFIG['out_dir'])
+    parser.add_argument('--star-db', default=CONFIG['star_db'])
+    parser.add_argument('--builds', nargs='+', default=['stacked'],
+                        choices=sorted(build_orion.DISPLAYS))
+    parser.add_argument('--only', nargs='+',
+                        help='constellation abbreviations to build')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes, defaults to the cpu count')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='rebuild everything, skipping the build cache')
+    parser.add_argument('--report-dir', default=CONFIG['report_dir'],
+                        help='write a json timing report per build here')
+    parser.add_argument('--profile', action='store_true',
+                        help='add a cProfile summary to each report')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='add a tracemalloc summary to each report')
+    args = parser.parse_args()
+
+    CONFIG.update(figures=args.figures, out_dir=args.out_dir,
+                  star_db=args.star_db, report_dir=args.report_dir,
+                  profile=args.profile, trace_memory=args.trace_memory)
+    if args.no_cache:
+        CONFIG['cache_dir'] = None
+    build_sky(CONFIG, args.builds, args.only, args.workers)
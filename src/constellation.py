@@ -1,23 +1,334 @@
 
+from collections.abc import Mapping
+from itertools import groupby
+import json
 from math import sin, cos, sqrt, radians, degrees
-import sqlite3
+from operator import itemgetter
 
 import numpy as np
 
+from binary_catalog import open_binary_catalog
 from indicies import *
+from instrumentation import count, span
+from sky_zones import angular_separation, cone_windows, ra_windows, \
+    zones_between
+from star_catalog import open_catalog
+
+# rows fetched from sqlite per bulk append to the star table
+LOAD_BATCH_SIZE = 5000
+
+
+def project_point(ra, dec, raC, decC):
+    '''
+    Project one star, all angles in radians, returns x, y.
+    The scalar reference for project_points.
+    '''
+    delta_ra = ra - raC
+    x1 = -1 * cos(dec) * sin(delta_ra)
+    y1 = sin(dec) * cos(decC) - cos(dec) * cos(delta_ra) * sin(decC)
+    z1 = sin(dec) * sin(decC) + cos(dec) * cos(decC) * cos(delta_ra)
+    if (z1 < -.9):
+        d = 20. * sqrt((1. - .81) / (1.00001 - z1 * z1))
+    else:
+        d = 2. / (z1 + 1.)
+    return x1 * d, y1 * d
+
+
+def project_points(ra, dec, raC, decC):
+    '''
+    Project arrays of ra and dec around the center in one pass,
+    all angles in radians, returns an (n, 2) array of x, y.
+    '''
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    delta_ra = ra - raC
+    cos_dec = np.cos(dec)
+    sin_dec = np.sin(dec)
+    cos_delta = np.cos(delta_ra)
+    x1 = -1 * cos_dec * np.sin(delta_ra)
+    y1 = sin_dec * cos(decC) - cos_dec * cos_delta * sin(decC)
+    z1 = sin_dec * sin(decC) + cos_dec * cos(decC) * cos_delta
+
+    # stars nearly opposite the center get the clamped scale
+    far = z1 < -.9
+    d = np.empty_like(z1)
+    d[~far] = 2. / (z1[~far] + 1.)
+    d[far] = 20. * np.sqrt((1. - .81) / (1.00001 - z1[far] * z1[far]))
+
+    projected = np.empty((len(z1), 2))
+    projected[:, PX] = x1 * d
+    projected[:, PY] = y1 * d
+    return projected
+
+
+class StarTable(Mapping):
+    '''
+    Columnar storage for the stars of a Constellation.
+
+    Numeric values live in NumPy arrays, one row per star, with an
+    hyg_id -> row index.  Reads like the dict of ConstellationPoints
+    it replaces, handing out points that are views onto a row.
+
+    radec: ra (hours), dec (degrees)
+    xyz: projected x, distance, projected y, the get_xyz_ish layout.
+    Unprojected stars hold NaN in the projected columns.
+
+    Min/max bounds of both are kept as rows are added, anything that
+    overwrites values calls touch_angles/touch_positions so the
+    bounds are recomputed on next use.
+    '''
+
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.rows = {}
+        self.hyg_id = np.empty(capacity, dtype=np.int64)
+        self.radec = np.empty((capacity, 2))
+        self.xyz = np.full((capacity, 3), np.nan)
+        self.magnitude = np.full(capacity, np.nan)
+        self.designation = []
+        self.proper_name = []
+        self._angle_bounds = _empty_bounds(2)
+        self._position_bounds = _empty_bounds(3)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.hyg_id[:self.size].tolist())
+
+    def __contains__(self, hyg_id):
+        return hyg_id in self.rows
+
+    def __getitem__(self, hyg_id):
+        return ConstellationPoint.view(self, self.rows[hyg_id])
+
+    @property
+    def ids(self):
+        return self.hyg_id[:self.size]
+
+    @property
+    def angles(self):
+        return self.radec[:self.size]
+
+    @property
+    def positions(self):
+        return self.xyz[:self.size]
+
+    @property
+    def magnitudes(self):
+        return self.magnitude[:self.size]
+
+    @property
+    def angle_bounds(self):
+        '''
+        (2, 2) array, row 0 the min and row 1 the max of ra, dec
+        '''
+        if self._angle_bounds is None:
+            self._angle_bounds = _bounds(self.angles)
+        return self._angle_bounds
+
+    @property
+    def position_bounds(self):
+        '''
+        (2, 3) array, row 0 the min and row 1 the max of the xyz columns
+        '''
+        if self._position_bounds is None:
+            self._position_bounds = _bounds(self.positions)
+        return self._position_bounds
+
+    def touch_angles(self):
+        self._angle_bounds = None
+
+    def touch_positions(self):
+        self._position_bounds = None
+
+    def _grow_bounds(self, start, end):
+        # new rows can only widen the bounds, stale bounds stay stale
+        if self._angle_bounds is not None:
+            self._angle_bounds = _merge_bounds(
+                self._angle_bounds, _bounds(self.radec[start:end]))
+        if self._position_bounds is not None:
+            self._position_bounds = _merge_bounds(
+                self._position_bounds, _bounds(self.xyz[start:end]))
+
+    def _reserve(self, count):
+        capacity = len(self.hyg_id)
+        if self.size + count <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + count)
+        grown = capacity - len(self.hyg_id)
+        self.hyg_id = np.concatenate(
+            (self.hyg_id, np.empty(grown, dtype=np.int64)))
+        self.radec = np.concatenate((self.radec, np.empty((grown, 2))))
+        self.xyz = np.concatenate((self.xyz, np.full((grown, 3), np.nan)))
+        self.magnitude = np.concatenate(
+            (self.magnitude, np.full(grown, np.nan)))
+
+    def _set_row(self, row, hyg_id, designation, proper_name, ra, dec,
+                 distance, magnitude):
+        self.hyg_id[row] = hyg_id
+        self.radec[row] = ra, dec
+        self.xyz[row] = np.nan, _number(distance), np.nan
+        self.magnitude[row] = _number(magnitude)
+        self.designation[row] = designation or ""
+        self.proper_name[row] = proper_name or ""
+
+    def append(self, hyg_id, designation, proper_name, ra, dec, distance,
+               magnitude):
+        '''
+        Add or replace one star, returns its row.
+        '''
+        row = self.rows.get(hyg_id)
+        if row is None:
+            self._reserve(1)
+            row = self.size
+            self.size += 1
+            self.rows[hyg_id] = row
+            self.designation.append("")
+            self.proper_name.append("")
+            self._set_row(row, hyg_id, designation, proper_name, ra, dec,
+                          distance, magnitude)
+            self._grow_bounds(row, row + 1)
+        else:
+            self._set_row(row, hyg_id, designation, proper_name, ra, dec,
+                          distance, magnitude)
+            self.touch_angles()
+            self.touch_positions()
+        return row
+
+    def extend(self, hyg_id, designation, proper_name, ra, dec, distance,
+               magnitude):
+        '''
+        Add many stars from parallel sequences, None for missing values.
+        '''
+        hyg_id = list(hyg_id)
+        if len(set(hyg_id)) != len(hyg_id) or not self.rows.keys().isdisjoint(hyg_id):
+            for values in zip(hyg_id, designation, proper_name, ra, dec,
+                              distance, magnitude):
+                self.append(*values)
+            return
+
+        count = len(hyg_id)
+        self._reserve(count)
+        start, end = self.size, self.size + count
+        self.hyg_id[start:end] = hyg_id
+        self.radec[start:end, 0] = np.array(ra, dtype=float)
+        self.radec[start:end, 1] = np.array(dec, dtype=float)
+        self.xyz[start:end, PY] = np.array(distance, dtype=float)
+        self.magnitude[start:end] = np.array(magnitude, dtype=float)
+        self.designation.extend(d or "" for d in designation)
+        self.proper_name.extend(n or "" for n in proper_name)
+        self.rows.update(zip(hyg_id, range(start, end)))
+        self.size = end
+        self._grow_bounds(start, end)
+
+
+def _empty_bounds(width):
+    return np.array([[np.inf] * width, [-np.inf] * width])
+
+
+def _bounds(values):
+    if not len(values):
+        return _empty_bounds(values.shape[1])
+    return np.array([np.min(values, axis=0), np.max(values, axis=0)])
+
+
+def _merge_bounds(a, b):
+    return np.array([np.minimum(a[0], b[0]), np.maximum(a[1], b[1])])
+
+
+def _number(value):
+    if value is None or value == "":
+        return np.nan
+    return float(value)
+
 
 class ConstellationPoint(object):
+    '''
+    A star, as a view onto one row of a StarTable.  Constructing a
+    point directly gives it a table of its own, Constellation.add_star
+    copies it into the constellation's table and rebinds it there.
+
+    Missing distance and magnitude are NaN.  projected is None until
+    the star is projected, then a float pair viewing the table row.
+    '''
+
+    __slots__ = ('_table', '_row')
 
     def __init__(self, hyg_id, designation, proper_name, ra, dec,
                  distance, magnitude):
-        self.hyg_id = hyg_id
-        self.designation = designation or ""
-        self.proper_name = proper_name or ""
-        self.ra = ra
-        self.dec = dec
-        self.distance = distance or ""
-        self.magnitude = magnitude or ""
-        self.projected = None
+        self._table = StarTable(capacity=1)
+        self._row = self._table.append(hyg_id, designation, proper_name,
+                                       ra, dec, distance, magnitude)
+
+    @classmethod
+    def view(cls, table, row):
+        point = cls.__new__(cls)
+        point._table = table
+        point._row = row
+        return point
+
+    @property
+    def hyg_id(self):
+        return int(self._table.hyg_id[self._row])
+
+    @property
+    def designation(self):
+        return self._table.designation[self._row]
+
+    @property
+    def proper_name(self):
+        return self._table.proper_name[self._row]
+
+    @property
+    def ra(self):
+        return float(self._table.radec[self._row, 0])
+
+    @ra.setter
+    def ra(self, value):
+        self._table.radec[self._row, 0] = value
+        self._table.touch_angles()
+
+    @property
+    def dec(self):
+        return float(self._table.radec[self._row, 1])
+
+    @dec.setter
+    def dec(self, value):
+        self._table.radec[self._row, 1] = value
+        self._table.touch_angles()
+
+    @property
+    def distance(self):
+        return float(self._table.xyz[self._row, PY])
+
+    @distance.setter
+    def distance(self, value):
+        self._table.xyz[self._row, PY] = _number(value)
+        self._table.touch_positions()
+
+    @property
+    def magnitude(self):
+        return float(self._table.magnitude[self._row])
+
+    @property
+    def is_projected(self):
+        return not np.isnan(self._table.xyz[self._row, PX])
+
+    @property
+    def projected(self):
+        if not self.is_projected:
+            return None
+        # x and y sit either side of distance in the xyz row
+        return self._table.xyz[self._row, ::2]
+
+    @projected.setter
+    def projected(self, value):
+        if value is None:
+            value = (np.nan, np.nan)
+        self._table.xyz[self._row, PX] = value[0]
+        self._table.xyz[self._row, PZ] = value[1]
+        self._table.touch_positions()
 
     @property
     def key(self):
@@ -39,10 +350,12 @@ class ConstellationPoint(object):
         z = projected y
         Using distance as Y like ElevationGrid uses Y
         '''
-        if not self.projected:
+        if not self.is_projected:
             return False
 
-        return np.array([self.projected[PX], self.distance, self.projected[PY]])
+        # a view onto the star table row, copy before modifying, the
+        # table's cached bounds don't see writes through it
+        return self._table.xyz[self._row]
 
     def __str__(self):
         return "<ConstellationPoint {:10} ra:{:8} dec:{:10} projection:{}>" \
@@ -54,7 +367,7 @@ class Constellation(object):
     def __init__(self, abbreviation, config, mag=4):
         self.config = config
         self.abbreviation = abbreviation
-        self.stars = {}
+        self.stars = StarTable()
         self.magnitude_filter = mag
         self.connections = []
 
@@ -65,26 +378,32 @@ class Constellation(object):
         return "<Constellation {} \n\t{}>".format(self.abbreviation, "\n\t".join(stars))
 
     def add_star(self, star):
-        self.stars[star.index] = star
+        src, row = star._table, star._row
+        xyz = src.xyz[row].copy()
+        star._row = self.stars.append(
+            star.hyg_id, star.designation, star.proper_name, star.ra,
+            star.dec, xyz[PY], src.magnitude[row])
+        star._table = self.stars
+        self.stars.xyz[star._row] = xyz
+        self.stars.touch_positions()
 
     def get_star(self, index):
         return self.stars[index]
 
     def get_range(self):
-        positions = np.array([x.get_xyz_ish() for x in self.stars.values()])
-        return [(np.min(positions[:, PX]), np.max(positions[:, PX])),
-                (np.min(positions[:, PY]), np.max(positions[:, PY])),
-                (np.min(positions[:, PZ]), np.max(positions[:, PZ]))]
+        low, high = self.stars.position_bounds
+        return [(low[PX], high[PX]),
+                (low[PY], high[PY]),
+                (low[PZ], high[PZ])]
 
     def generate_select_in_parts(self, selection_ids):
-        sql_keys = []
-        sql_data = {}
-        for i, s in enumerate(selection_ids):
-            key = 'i{}'.format(i)
-            sql_keys.append(':{}'.format(key))
-            sql_data[key] = s
-
-        sql_str = "id in ({})".format(",".join(sql_keys))
+        '''
+        The ids go in as one json array parameter, so every selection
+        runs the same prepared statement whatever its size, and the
+        bound variable limit never comes into it.
+        '''
+        sql_str = "id IN (SELECT value FROM json_each(:ids))"
+        sql_data = {'ids': json.dumps([int(i) for i in selection_ids])}
 
         return sql_str, sql_data
 
@@ -96,13 +415,33 @@ class Constellation(object):
         else:
             sql_str = '''
             constellation = :con AND
-            bayer_flamsteed_designation != "" AND
+            bayer_flamsteed_designation IS NOT NULL AND
             magnitude < :mag'''
             sql_data = {'con': self.abbreviation,
                         'mag': self.magnitude_filter}
 
         return sql_str, sql_data
 
+    def zone_sql(self, zones, windows):
+        '''
+        Select the stars in the given dec zones and ra windows, for the
+        (zone, ra) index built by the loader
+        '''
+        ra_keys = []
+        sql_data = {'zones': json.dumps(zones),
+                    'mag': self.magnitude_filter}
+        for i, window in enumerate(windows):
+            ra_keys.append('ra BETWEEN :ra_lo{0} AND :ra_hi{0}'.format(i))
+            sql_data['ra_lo{}'.format(i)] = window[0]
+            sql_data['ra_hi{}'.format(i)] = window[1]
+
+        sql_str = '''
+            zone IN (SELECT value FROM json_each(:zones)) AND
+            ({}) AND
+            magnitude < :mag'''.format(' OR '.join(ra_keys))
+
+        return sql_str, sql_data
+
     def set_connections(self, connections):
         '''
         Accept a list of tuples defining lines between
@@ -116,24 +455,36 @@ class Constellation(object):
     def get_connection_stars(self, connection):
         return self.stars[connection[0]], self.stars[connection[1]]
 
-    def load_stars_from_sqlite(self, star_db_file, selection=None):
+    def get_magnitude_order(self):
         '''
-        load star data via one of two modes:
-        * Constellation
-        Use the abbreviate and magnitfude to filter stars from the
-        constellation area.
-        * Selection
-        Load star data based on the 'selection' list containing
-        ids of stars selected for a models.
+        Star table rows brightest first, missing magnitudes last
+        '''
+        return np.argsort(self.stars.magnitudes, kind='stable')
+
+    def get_stars_by_magnitude(self):
+        return [ConstellationPoint.view(self.stars, row)
+                for row in self.get_magnitude_order().tolist()]
+
+    def get_connection_rows(self):
         '''
-        conn = sqlite3.connect(star_db_file)
-        conn.row_factory = sqlite3.Row
+        (n, 2) array of the star table rows at each end of each connection
+        '''
+        rows = self.stars.rows
+        return np.array([(rows[a], rows[b]) for a, b in self.connections],
+                        dtype=np.int64).reshape(-1, 2)
 
+    def star_query(self, selection=None):
+        '''
+        Build the star SELECT and its parameters for the loading mode
+        '''
         # we are either grabbing all the stars of a certain character
         # or just the stars in a list
 
         selection_sql, selection_data = self.selection_sql(selection)
 
+        return self.select_sql(selection_sql), selection_data
+
+    def select_sql(self, where_sql):
         sql = '''
         SELECT
         id,
@@ -144,16 +495,102 @@ class Constellation(object):
         dec,
         distance
         FROM stars WHERE
-        {selection_sql}
+        {where_sql}
         ORDER BY id ASC'''
 
-        sql = sql.format(selection_sql=selection_sql)
+        return sql.format(where_sql=where_sql)
+
+    def load_stars_from_sqlite(self, star_db_file, selection=None):
+        '''
+        load star data via one of two modes:
+        * Constellation
+        Use the abbreviate and magnitfude to filter stars from the
+        constellation area.
+        * Selection
+        Load star data based on the 'selection' list containing
+        ids of stars selected for a models.
+
+        star_db_file is a db path or a StarCatalog, paths share one
+        catalog handle per file.
+        '''
+        sql, selection_data = self.star_query(selection)
+        self._load_rows(star_db_file, sql, selection_data)
+
+    def load_stars_from_binary(self, catalog, selection=None):
+        '''
+        load_stars_from_sqlite for the binary catalog written by
+        hyg-loader.py --binary, catalog is its directory or a
+        BinaryCatalog.  Constellation mode is a slice of the mapped
+        records up to the magnitude filter.
+        '''
+        with span('binary load'):
+            catalog = open_binary_catalog(catalog)
+            if selection:
+                records = catalog.select(selection)
+            else:
+                records = catalog.constellation(self.abbreviation,
+                                                self.magnitude_filter)
+                records = records[records['designation'] != b'']
+                records = records[np.argsort(records['id'], kind='stable')]
+
+            self.stars.extend(records['id'].tolist(),
+                              [d.decode() for d in records['designation']],
+                              [n.decode() for n in records['proper_name']],
+                              records['ra'], records['dec'],
+                              records['distance'], records['magnitude'])
+        count('stars loaded', len(records))
+
+    def load_stars_in_cone(self, star_db_file, ra, dec, radius):
+        '''
+        Load the stars brighter than the magnitude filter within
+        radius degrees of ra (hours), dec (degrees).
+        '''
+        zones, windows = cone_windows(ra, dec, radius)
+        where_sql, sql_data = self.zone_sql(zones, windows)
+
+        def in_cone(star_ra, star_dec):
+            return angular_separation(ra, dec, star_ra, star_dec) <= radius
 
-        for row in conn.execute(sql, selection_data):
-            self.add_star(ConstellationPoint(row['id'], row['designation'],
-                                             row['proper_name'], row['ra'],
-                                             row['dec'], row['distance'],
-                                             row['magnitude']))
+        self._load_rows(star_db_file, self.select_sql(where_sql), sql_data,
+                        keep=in_cone)
+
+    def load_stars_in_box(self, star_db_file, ra_min, ra_max, dec_min,
+                          dec_max):
+        '''
+        Load the stars brighter than the magnitude filter inside an
+        ra (hours) / dec (degrees) box, ra_min > ra_max wraps through 0h.
+        '''
+        where_sql, sql_data = self.zone_sql(zones_between(dec_min, dec_max),
+                                            ra_windows(ra_min, ra_max))
+        where_sql += ''' AND
+            dec BETWEEN :dec_min AND :dec_max'''
+        sql_data['dec_min'] = dec_min
+        sql_data['dec_max'] = dec_max
+
+        self._load_rows(star_db_file, self.select_sql(where_sql), sql_data)
+
+    def _load_rows(self, star_db_file, sql, sql_data, keep=None):
+        '''
+        Append the rows of a select_sql query to the star table in
+        batches, keep(ra, dec) can return a mask of rows to keep.
+        '''
+        with span('sqlite'):
+            cursor = open_catalog(star_db_file).execute(sql, sql_data)
+            while True:
+                rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+                if not rows:
+                    break
+                if keep:
+                    mask = keep(*np.array([r[4:6] for r in rows],
+                                          dtype=float).T)
+                    rows = [r for r, k in zip(rows, mask) if k]
+                    if not rows:
+                        continue
+                (hyg_id, magnitude, proper_name, designation,
+                 ra, dec, distance) = zip(*rows)
+                self.stars.extend(hyg_id, designation, proper_name, ra, dec,
+                                  distance, magnitude)
+                count('stars loaded', len(rows))
 
     def find_center(self):
         '''
@@ -161,11 +598,7 @@ class Constellation(object):
         return mid_ra, mid_dec
         '''
 
-        angles = np.array([[x.ra, x.dec] for x in self.stars.values()])
-        stats = np.ndarray(shape=(2, 2))
-        stats[0] = np.amin(angles, 0)
-        stats[1] = np.amax(angles, 0)
-        mids = np.average(stats, axis=0)
+        mids = np.average(self.stars.angle_bounds, axis=0)
         return mids[0], mids[1]
 
     def project(self):
@@ -178,25 +611,25 @@ class Constellation(object):
         /* wlm added a -1 in code for looking out rather than down */
         x1 = cos( dec) * sin( delta_ra);
         y1 = sin( dec) * cos( dec0) - cos( dec) * cos( delta_ra) * sin( dec0);
+
+        All stars are projected together by project_points, the
+        results are stored in the star table and returned as an
+        (n, 2) array in self.stars order.
         '''
-        raC, decC = self.find_center()
-        raC = radians(raC * 15)
-        decC = radians(decC)
+        with span('project'):
+            raC, decC = self.find_center()
+            raC = radians(raC * 15)
+            decC = radians(decC)
 
-        for star in self.stars.values():
-            ra = radians(star.ra * 15)
-            dec = radians(star.dec)
-            delta_ra = ra - raC
-            x1 = -1 * cos(dec) * sin(delta_ra)
-            y1 = sin(dec) * cos(decC) - cos(dec) * cos(delta_ra) * sin(decC)
-            z1 = sin(dec) * sin(decC) + cos(dec) * cos(decC) * cos(delta_ra)
-            if (z1 < -.9):
-                d = 20. * sqrt((1. - .81) / (1.00001 - z1 * z1))
-            else:
-                d = 2. / (z1 + 1.)
-            x = x1 * d
-            y = y1 * d
-            star.projected = (x, y)
+            angles = self.stars.angles
+            projected = project_points(np.radians(angles[:, 0] * 15),
+                                       np.radians(angles[:, 1]), raC, decC)
+            positions = self.stars.positions
+            positions[:, PX] = projected[:, PX]
+            positions[:, PZ] = projected[:, PY]
+            self.stars.touch_positions()
+
+        return projected
 
     def project_plate_carre(self):
         raC, decC = self.find_center()
@@ -208,3 +641,61 @@ class Constellation(object):
             x = delta_ra / sin(decC)
             y = dec - decC
             self.stars[s].projected = (x, y)
+
+
+def load_constellations(star_db_file, abbreviations=None, config=None, mag=4):
+    '''
+    Load the constellation mode stars (see load_stars_from_sqlite) of
+    many constellations in one ordered pass over the catalog, instead
+    of one query per Constellation.  abbreviations None loads every
+    constellation.
+
+    Returns a dict of abbreviation to Constellation, each with the
+    same stars in the same order its own load would give.
+    '''
+    constellations = {}
+    sql_data = {'mag': mag}
+    if abbreviations is None:
+        where_sql = 'constellation IS NOT NULL'
+    else:
+        for abbreviation in abbreviations:
+            constellations[abbreviation] = Constellation(abbreviation, config, mag)
+        where_sql = 'constellation IN (SELECT value FROM json_each(:cons))'
+        sql_data['cons'] = json.dumps(list(constellations))
+
+    sql = '''
+        SELECT
+        id,
+        magnitude,
+        proper_name,
+        bayer_flamsteed_designation as designation,
+        ra,
+        dec,
+        distance,
+        constellation
+        FROM stars WHERE
+        {where_sql} AND
+        bayer_flamsteed_designation IS NOT NULL AND
+        magnitude < :mag
+        ORDER BY constellation, id ASC'''.format(where_sql=where_sql)
+
+    with span('sqlite'):
+        cursor = open_catalog(star_db_file).execute(sql, sql_data)
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            # rows come grouped by constellation, a group may continue
+            # into the next batch
+            for abbreviation, group in groupby(rows, key=itemgetter(7)):
+                con = constellations.get(abbreviation)
+                if con is None:
+                    con = Constellation(abbreviation, config, mag)
+                    constellations[abbreviation] = con
+                (hyg_id, magnitude, proper_name, designation,
+                 ra, dec, distance, _) = zip(*group)
+                con.stars.extend(hyg_id, designation, proper_name, ra, dec,
+                                 distance, magnitude)
+            count('stars loaded', len(rows))
+
+    return constellations
@@ -1,5 +1,10 @@
-from bokeh.plotting import figure, output_file, show
-from bokeh.models import Label, WheelZoomTool, Segment
+from bokeh.plotting import figure, output_file, save, show
+from bokeh.models import ColumnDataSource, LabelSet, WheelZoomTool
+from bokeh.palettes import Greys256
+import numpy as np
+
+from indicies import *
+from instrumentation import span
 
 
 class ConstellationChart(object):
@@ -8,34 +13,114 @@ class ConstellationChart(object):
         self.constellation = constellation
         self.featured_stars = featured_stars
 
-    def chart2D(self):
-        # cons, stars, connections):
-        star_x = []
-        star_y = []
-        for s in sorted(self.constellation.stars):
-            projected = self.constellation.stars[s].projected
-            if projected:
-                star_x.append(projected[0])
-                star_y.append(projected[1])
-
-        output_file("stars.html")
-        p = figure(plot_width=800, plot_height=800, title='orion')
+    def split_by_detail(self, max_detailed_stars):
+        '''
+        Star table rows for the featured stars and the
+        max_detailed_stars brightest of the rest, and the rows of the
+        remaining faint stars
+        '''
+        order = self.constellation.get_magnitude_order()
+        featured = np.isin(self.constellation.stars.ids[order],
+                           list(self.featured_stars or []))
+        rest = order[~featured]
+        detailed = np.concatenate([order[featured], rest[:max_detailed_stars]])
+        return detailed, rest[max_detailed_stars:]
+
+    def star_source(self, rows):
+        '''
+        One ColumnDataSource row per star, for the circle and label layers
+        '''
+        stars = self.constellation.stars
+        featured = set(self.featured_stars or [])
+        ids = stars.ids[rows].tolist()
+        keys = [stars.proper_name[r] or stars.designation[r] or i
+                for r, i in zip(rows.tolist(), ids)]
+        magnitudes = stars.magnitudes[rows].tolist()
+        return ColumnDataSource(data={
+            'x': stars.positions[rows, PX],
+            'y': stars.positions[rows, PZ],
+            'key': keys,
+            'color': ["#000000" if i in featured else "#cccccc" for i in ids],
+            'label': ["{}:{} {:.2f}".format(i, k, m)
+                      for i, k, m in zip(ids, keys, magnitudes)]})
+
+    def connection_source(self):
+        positions = self.constellation.stars.positions
+        ends = self.constellation.get_connection_rows()
+        return ColumnDataSource(data={
+            'x0': positions[ends[:, 0], PX], 'y0': positions[ends[:, 0], PZ],
+            'x1': positions[ends[:, 1], PX], 'y1': positions[ends[:, 1], PZ]})
+
+    def density_image(self, rows, bins):
+        '''
+        Bin the projected stars into a bins x bins histogram weighted
+        by flux (10 ** (-0.4 * magnitude)), log scaled for display.
+        Returns the image and its x, y, width and height.
+        '''
+        stars = self.constellation.stars
+        x = stars.positions[rows, PX]
+        y = stars.positions[rows, PZ]
+        flux = np.nan_to_num(10 ** (-0.4 * stars.magnitudes[rows]))
+        shown = ~(np.isnan(x) | np.isnan(y))
+        x, y, flux = x[shown], y[shown], flux[shown]
+        if not len(x):
+            return np.zeros((bins, bins), np.float32), 0, 0, 1, 1
+
+        histogram, x_edges, y_edges = np.histogram2d(x, y, bins=bins,
+                                                     weights=flux)
+        image = np.log1p(histogram / (histogram.max() or 1) * 1000)
+        # histogram2d indexes [x, y], images are rows of y
+        return (image.T.astype(np.float32), x_edges[0], y_edges[0],
+                x_edges[-1] - x_edges[0], y_edges[-1] - y_edges[0])
+
+    def chart2D(self, max_detailed_stars=None, webgl=False,
+                density_bins=None, output_filename="stars.html",
+                show_chart=True):
+        '''
+        Each layer (faint stars, stars, labels, connections) is one
+        glyph over one ColumnDataSource.
+
+        max_detailed_stars caps the labeled stars to the brightest n,
+        fainter stars are aggregated into a single unlabeled glyph.
+        webgl renders the glyphs with the WebGL backend.
+        density_bins draws every star but the featured ones as a
+        density_bins square image, so the chart's size doesn't grow
+        with the starfield, the featured stars and connections are
+        drawn over it.
+        show_chart False only saves the chart to output_filename.
+        '''
+        output_file(output_filename, title=self.constellation.abbreviation)
+        p = figure(plot_width=800, plot_height=800,
+                   title=self.constellation.abbreviation,
+                   output_backend="webgl" if webgl else "canvas")
         p.toolbar.active_scroll = WheelZoomTool()
-        for star in self.constellation.stars.values():
-            if self.featured_stars and star.hyg_id in self.featured_stars:
-                circle_color = "#000000"
+
+        if density_bins:
+            detailed, faint = self.split_by_detail(0)
+            image, x, y, dw, dh = self.density_image(faint, density_bins)
+            p.image(image=[image], x=x, y=y, dw=dw, dh=dh,
+                    palette=list(reversed(Greys256)))
+            faint = faint[:0]
+        elif max_detailed_stars is None:
+            detailed = np.arange(len(self.constellation.stars))
+            faint = detailed[:0]
+        else:
+            detailed, faint = self.split_by_detail(max_detailed_stars)
+        positions = self.constellation.stars.positions
+        if len(faint):
+            p.circle(positions[faint, PX], positions[faint, PZ],
+                     size=4, color="#dddddd")
+
+        stars = self.star_source(detailed)
+        p.circle('x', 'y', source=stars, size=10, color='color')
+        p.add_layout(LabelSet(x='x', y='y', text='label', source=stars,
+                              text_color="#999999"))
+
+        p.segment('x0', 'y0', 'x1', 'y1', source=self.connection_source(),
+                  line_color="#aaeeaa", line_width=4)
+
+        with span('html'):
+            if show_chart:
+                show(p, browser="safari", new="window")
             else:
-                circle_color = "#cccccc"
-            p.circle(star.projected[0], star.projected[1],
-                     name=star.key, size=10, color=circle_color)
-            p.add_layout(Label(x=star.projected[0], y=star.projected[1],
-                               text="{}:{} {:.2f}".format(star.hyg_id, star.key,
-                               star.magnitude), text_color="#999999"))
-        for connection in self.constellation.connections:
-            a = self.constellation.get_star(connection[0])
-            b = self.constellation.get_star(connection[1])
-            glyph = Segment(x0=a.projected[0], y0=a.projected[1], x1=b.projected[0],
-                            y1=b.projected[1], line_color="#aaeeaa", line_width=4)
-            p.add_glyph(glyph)
-
-        show(p, browser="safari", new="window")
+                save(p)
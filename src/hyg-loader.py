@@ -1,9 +1,18 @@
+import argparse
 import csv
 import sqlite3
+import time
+from itertools import islice
+
+from binary_catalog import write_binary_catalog
+from sky_zones import zone_of
 
 CONFIG = {
     'src_csv': "../data/HYG-Database/hygdata_v3.csv",
-    'sqlite_db': "../data/sc_db/stars.db"
+    'sqlite_db': "../data/sc_db/stars.db",
+    'binary_dir': "../data/sc_db/stars_npy",
+    'batch_size': 10000,
+    'covering_index': False
 }
 
 # load a selection of the HYG database into sqlite.
@@ -13,54 +22,110 @@ CONFIG = {
 #ci,x,y,z,vx,vy,vz,rarad,decrad,pmrarad,pmdecrad,bayer,flam,con,
 #comp,comp_primary,base,lum,var,var_min,var_max
 
+# (csv column, table column, declared type)
+# gliese ids are catalog strings like "Gl 551" or "NN 4001", so TEXT
+STAR_COLUMNS = [('id', 'id', 'INTEGER'),
+                ('hip', 'hipparcos_id', 'INT'),
+                ('hd', 'henry_draper_id', 'INT'),
+                ('hr', 'harvard_revised_id', 'INT'),
+                ('gl', 'gliese_id', 'TEXT'),
+                ('bf', 'bayer_flamsteed_designation', 'TEXT'),
+                ('proper', 'proper_name', 'TEXT'),
+                ('ra', 'ra', 'REAL'),
+                ('dec', 'dec', 'REAL'),
+                ('dist', 'distance', 'REAL'),
+                ('mag', 'magnitude', 'REAL'),
+                ('x', 'x', 'REAL'),
+                ('y', 'y', 'REAL'),
+                ('z', 'z', 'REAL'),
+                ('con', 'constellation', 'TEXT'),
+                ('comp', 'companion_star_id', 'INT'),
+                ('comp_primary', 'primary_star_id', 'INT'),
+                ('base', 'multi_star_id', 'TEXT'),
+                ('var', 'variable_star_designation', 'TEXT')]
+
+# derived from dec for cone and box searches, see sky_zones
+ZONE_COLUMN = ('zone', 'INT')
+DEC_INDEX = [c[1] for c in STAR_COLUMNS].index('dec')
+
+TYPE_CONVERTERS = {
+    'INTEGER': int,
+    'INT': int,
+    'REAL': float,
+    'TEXT': str
+}
+
+
+# the constellation/magnitude filter used by Constellation, created
+# after the bulk insert so the rows aren't indexed one at a time
+STAR_INDEX_SQL = '''
+    CREATE INDEX stars_constellation_magnitude
+    ON stars (constellation, magnitude)'''
+
+STAR_ZONE_INDEX_SQL = '''
+    CREATE INDEX stars_zone_ra
+    ON stars (zone, ra)'''
+
+# covers every column load_stars_from_sqlite selects, id is the rowid
+STAR_COVERING_INDEX_SQL = '''
+    CREATE INDEX stars_constellation_covering
+    ON stars (constellation, magnitude, bayer_flamsteed_designation,
+              proper_name, ra, dec, distance)'''
+
+
+def column_converter(sql_type):
+    '''
+    Build a converter for one declared column type, the csv uses
+    empty strings for missing values and those become NULL.
+    '''
+    convert = TYPE_CONVERTERS[sql_type]
+
+    def converter(value):
+        if value == '':
+            return None
+        return convert(value)
+
+    return converter
+
+
+def convert_batch(batch, converters):
+    '''
+    Convert a batch of raw csv rows column by column, running each
+    column through a single converter, then zip back into rows with
+    the derived zone column on the end.
+    '''
+    columns = zip(*batch)
+    typed = [list(map(c, col)) for c, col in zip(converters, columns)]
+    typed.append(list(map(zone_of, typed[DEC_INDEX])))
+    return list(zip(*typed))
+
+
+def read_batches(src_reader, table_info, batch_size):
+    '''
+    Yield lists of at most batch_size rows from the csv reader, so
+    only one batch of the catalog is held in memory at a time.
+    '''
+    while True:
+        batch = [[s[item[0]] for item in table_info]
+                 for s in islice(src_reader, batch_size)]
+        if not batch:
+            return
+        yield batch
 
 
 def load_stars(config):
 
-    star_table_sql = '''
-        CREATE TABLE stars (
-        id INT,
-        hipparcos_id INT,
-        henry_draper_id INT,
-        harvard_revised_id INT,
-        gliese_id INT,
-        bayer_flamsteed_designation TEXT,
-        proper_name TEXT,
-        ra REAL,
-        dec REAL,
-        distance REAL,
-        magnitude REAL,
-        x REAL,
-        y REAL,
-        z REAL,
-        constellation TEXT,
-        companion_star_id INT,
-        primary_star_id INT,
-        multi_star_id TEXT,
-        variable_star_designation TEXT)'''
-
-    table_info = [('id', 'id'),
-                  ('hip', 'hipparcos_id'),
-                  ('hd', 'henry_draper_id'),
-                  ('hr', 'harvard_revised_id'),
-                  ('gl', 'gliese_id'),
-                  ('bf', 'bayer_flamsteed_desig'),
-                  ('proper', 'proper_name'),
-                  ('ra', 'ra'),
-                  ('dec', 'dec'),
-                  ('dist', 'distance'),
-                  ('mag', 'magnitude'),
-                  ('x', 'x'),
-                  ('y', 'y'),
-                  ('z', 'z'),
-                  ('con', 'constellation'),
-                  ('comp', 'companion_star_id'),
-                  ('comp_primary', 'primary_star_id'),
-                  ('base', 'multi_star_id'),
-                  ('var', 'variable_star_designation')]
+    columns = [c[1:] for c in STAR_COLUMNS] + [ZONE_COLUMN]
+    star_table_sql = 'CREATE TABLE stars ({}, PRIMARY KEY (id))'.format(
+        ', '.join('{} {}'.format(*c) for c in columns))
 
-    star_conn = sqlite3.connect(config['sqlite_db'])
+    # manage the transaction ourselves, the whole load is one commit
+    star_conn = sqlite3.connect(config['sqlite_db'], isolation_level=None)
     cur = star_conn.cursor()
+    # the db is rebuilt from the csv on every run, so skip durability
+    # while loading
+    cur.execute('PRAGMA journal_mode = OFF')
+    cur.execute('PRAGMA synchronous = OFF')
     try:
         cur.execute('DROP TABLE stars')
     except sqlite3.OperationalError:
@@ -69,21 +134,80 @@ def load_stars(config):
 
     cur.execute(star_table_sql)
 
-    qs = ','.join(['?']*len(table_info))
+    qs = ','.join(['?']*len(columns))
     insert_sql = "INSERT INTO stars VALUES ({})".format(qs)
-    datas = []
+    batch_size = config.get('batch_size', 10000)
+    converters = [column_converter(c[2]) for c in STAR_COLUMNS]
 
-    with open(config['src_csv']) as src_fh:
+    start = time.perf_counter()
+    total = 0
+    cur.execute('BEGIN')
+    with open(config['src_csv'], newline='') as src_fh:
         src_reader = csv.DictReader(src_fh)
-        for s in src_reader:
-            row_data = []
-            for item in table_info:
-                row_data.append(s[item[0]])
-            datas.append(row_data)
-
-    cur.executemany(insert_sql, datas)
-    star_conn.commit()
+        for batch in read_batches(src_reader, STAR_COLUMNS, batch_size):
+            cur.executemany(insert_sql, convert_batch(batch, converters))
+            total += len(batch)
+            elapsed = time.perf_counter() - start
+            print("Loaded {} rows ({:.0f} rows/sec)".format(
+                total, total / elapsed if elapsed else 0))
+    # the covering index leads with the same columns, so it serves
+    # the constellation filter on its own
+    if config.get('covering_index'):
+        cur.execute(STAR_COVERING_INDEX_SQL)
+    else:
+        cur.execute(STAR_INDEX_SQL)
+    cur.execute(STAR_ZONE_INDEX_SQL)
+    cur.execute('COMMIT')
+    cur.execute('ANALYZE')
+
+    cur.execute('PRAGMA synchronous = FULL')
+    cur.execute('PRAGMA journal_mode = DELETE')
+    star_conn.close()
+
+
+def export_binary(config):
+    '''
+    Write the memory-mappable binary catalog from the loaded sqlite db
+    '''
+    star_conn = sqlite3.connect(config['sqlite_db'])
+    count = write_binary_catalog(star_conn, config['binary_dir'],
+                                 config.get('batch_size', 10000))
     star_conn.close()
+    print("Wrote {} stars to {}".format(count, config['binary_dir']))
+
+
+def explain_queries(config, abbreviation='Ori', selection=(1, 2, 3)):
+    '''
+    Print the EXPLAIN QUERY PLAN for the queries Constellation runs,
+    to check both loading modes are served by an index.
+    '''
+    from constellation import Constellation
+
+    star_conn = sqlite3.connect(config['sqlite_db'])
+    con = Constellation(abbreviation, config)
+    for mode, sel in (('constellation', None), ('selection', selection)):
+        sql, data = con.star_query(sel)
+        print("{} query:".format(mode))
+        for row in star_conn.execute('EXPLAIN QUERY PLAN ' + sql, data):
+            print("    {}".format(row[-1]))
+    star_conn.close()
+
 
 if __name__ == '__main__':
-    load_stars(CONFIG)
+    parser = argparse.ArgumentParser(
+        description='Load the HYG csv into the stars sqlite db')
+    parser.add_argument('--covering-index', action='store_true',
+                        help='index every column the loaders select')
+    parser.add_argument('--explain', action='store_true',
+                        help='print query plans instead of loading')
+    parser.add_argument('--binary', action='store_true',
+                        help='also write the binary catalog to binary_dir')
+    args = parser.parse_args()
+
+    CONFIG['covering_index'] = args.covering_index
+    if args.explain:
+        explain_queries(CONFIG)
+    else:
+        load_stars(CONFIG)
+        if args.binary:
+            export_binary(CONFIG)
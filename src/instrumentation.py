@@ -0,0 +1,150 @@
+'''
+Timing spans and counters for model builds.
+
+    with build_report('Ori stacked', profile=True) as report:
+        ...build...
+
+Code along the build path marks its stages with span('sqlite') and
+tallies work with count('elements', n).  Both do nothing unless a
+build_report is active, so the hooks stay in place for normal runs.
+Spans with the same name add up, a span entered once per batch is
+one line in the report with its total time and number of calls.
+
+profile runs cProfile over the whole build and trace_memory
+tracemalloc, their summaries are added to the report.
+'''
+
+from contextlib import contextmanager
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+PROFILE_LINES = 20
+MEMORY_LINES = 10
+
+_report = None
+
+
+class BuildReport(object):
+
+    def __init__(self, name, profile=False, trace_memory=False):
+        self.name = name
+        self.spans = {}
+        self.counters = {}
+        self.seconds = None
+        self.peak_bytes = None
+        self.profile_text = None
+        self.memory_text = None
+        self._stack = []
+        self._profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self._profiler:
+            self._profiler.enable()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self._start
+        if self._profiler:
+            self._profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(self._profiler, stream=text).sort_stats(
+                'cumulative').print_stats(PROFILE_LINES)
+            self.profile_text = text.getvalue()
+        if self.trace_memory:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics('lineno')
+            self.memory_text = '\n'.join(str(s) for s in top[:MEMORY_LINES])
+            tracemalloc.stop()
+
+    @contextmanager
+    def span(self, name):
+        # nested spans are named by their path, "write/render"
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._stack.pop()
+            span = self.spans.setdefault(path, {'seconds': 0, 'calls': 0})
+            span['seconds'] += seconds
+            span['calls'] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        return {'name': self.name,
+                'seconds': self.seconds,
+                'spans': self.spans,
+                'counters': self.counters,
+                'peak_bytes': self.peak_bytes}
+
+    def print_report(self):
+        print("Build report: {} {:.3f}s".format(self.name, self.seconds))
+        for path, span in self.spans.items():
+            print("  {:24} {:9.3f}s {:6d} calls".format(
+                path, span['seconds'], span['calls']))
+        for name, value in self.counters.items():
+            print("  {:24} {:10d}".format(name, value))
+        if self.peak_bytes is not None:
+            print("  {:24} {:9.1f} MiB".format('peak memory',
+                                               self.peak_bytes / 2 ** 20))
+
+    def write(self, report_dir):
+        os.makedirs(report_dir, exist_ok=True)
+        base = os.path.join(report_dir, self.name.replace(' ', '_'))
+        with open(base + '.json', 'w') as report_file:
+            json.dump(self.as_dict(), report_file, indent=1)
+        if self.profile_text:
+            with open(base + '.profile.txt', 'w') as profile_file:
+                profile_file.write(self.profile_text)
+        if self.memory_text:
+            with open(base + '.memory.txt', 'w') as memory_file:
+                memory_file.write(self.memory_text)
+
+
+@contextmanager
+def build_report(name, profile=False, trace_memory=False, report_dir=None,
+                 verbose=True):
+    '''
+    Collect spans and counters for the build run inside the with
+    block, printed at the end and written as json (with the profile
+    and memory summaries) to report_dir if given.
+    '''
+    global _report
+    report = BuildReport(name, profile, trace_memory)
+    previous, _report = _report, report
+    report.start()
+    try:
+        yield report
+    finally:
+        report.stop()
+        _report = previous
+        if verbose:
+            report.print_report()
+        if report_dir:
+            report.write(report_dir)
+
+
+@contextmanager
+def span(name):
+    if _report is None:
+        yield
+    else:
+        with _report.span(name):
+            yield
+
+
+def count(name, n=1):
+    if _report is not None:
+        _report.count(name, n)
@@ -0,0 +1,92 @@
+'''
+Binary STL and glTF (.glb) writers for the meshes from vrml_mesh.
+
+Both write the triangle buffers straight from the NumPy arrays.
+Model coordinates are millimetres, STL keeps them as is (what
+slicers expect) and glTF, whose unit is the metre, is scaled by
+0.001 by default.
+'''
+
+import json
+import struct
+
+import numpy as np
+
+STL_TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)),
+                               ('vertices', '<f4', (3, 3)),
+                               ('attributes', '<u2')])
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+GL_FLOAT = 5126
+GL_UNSIGNED_INT = 5125
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+
+def face_normals(vertices, faces):
+    triangles = vertices[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                       triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)[:, None]
+    return np.divide(normals, lengths, out=np.zeros_like(normals),
+                     where=lengths > 0)
+
+
+def write_stl(outfile, vertices, faces, header=b'coterie'):
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces)
+    triangles = np.zeros(len(faces), dtype=STL_TRIANGLE_DTYPE)
+    triangles['normal'] = face_normals(vertices, faces)
+    triangles['vertices'] = vertices[faces]
+
+    with open(outfile, 'wb') as dest_file:
+        dest_file.write(header[:80].ljust(80, b' '))
+        dest_file.write(struct.pack('<I', len(triangles)))
+        dest_file.write(triangles.tobytes())
+
+
+def _pad(data, fill):
+    return data + fill * (-len(data) % 4)
+
+
+def write_glb(outfile, vertices, faces, scale=0.001, name='coterie'):
+    positions = (np.asarray(vertices, dtype=float) * scale).astype('<f4')
+    indices = np.asarray(faces).astype('<u4').ravel()
+
+    position_bytes = positions.tobytes()
+    index_offset = len(_pad(position_bytes, b'\0'))
+    binary = _pad(_pad(position_bytes, b'\0') + indices.tobytes(), b'\0')
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'coterie'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'name': name}],
+        'meshes': [{'name': name, 'primitives': [
+            {'attributes': {'POSITION': 0}, 'indices': 1, 'mode': 4}]}],
+        'buffers': [{'byteLength': len(binary)}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0,
+             'byteLength': len(position_bytes), 'target': GL_ARRAY_BUFFER},
+            {'buffer': 0, 'byteOffset': index_offset,
+             'byteLength': indices.nbytes,
+             'target': GL_ELEMENT_ARRAY_BUFFER}],
+        'accessors': [
+            {'bufferView': 0, 'componentType': GL_FLOAT,
+             'count': len(positions), 'type': 'VEC3',
+             'min': positions.min(axis=0).tolist(),
+             'max': positions.max(axis=0).tolist()},
+            {'bufferView': 1, 'componentType': GL_UNSIGNED_INT,
+             'count': len(indices), 'type': 'SCALAR'}]
+    }
+    json_chunk = _pad(json.dumps(gltf, separators=(',', ':')).encode(), b' ')
+
+    with open(outfile, 'wb') as dest_file:
+        dest_file.write(struct.pack(
+            '<III', GLB_MAGIC, 2, 12 + 8 + len(json_chunk) + 8 + len(binary)))
+        dest_file.write(struct.pack('<II', len(json_chunk), GLB_JSON_CHUNK))
+        dest_file.write(json_chunk)
+        dest_file.write(struct.pack('<II', len(binary), GLB_BIN_CHUNK))
+        dest_file.write(binary)
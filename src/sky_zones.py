@@ -0,0 +1,70 @@
+'''
+Declination zones for cone and box searches of the star catalog.
+
+The sky is cut into bands ZONE_HEIGHT degrees of dec tall, the loader
+stores each star's band in the zone column and indexes (zone, ra), so
+a search only seeks the bands and ra windows it overlaps.
+ra is in hours and dec in degrees throughout, like the stars table.
+'''
+
+from math import asin, cos, sin, radians
+
+import numpy as np
+
+ZONE_HEIGHT = 1.0
+ZONE_COUNT = int(180 / ZONE_HEIGHT)
+
+
+def zone_of(dec):
+    if dec is None:
+        return None
+    return min(int((dec + 90) // ZONE_HEIGHT), ZONE_COUNT - 1)
+
+
+def zones_between(dec_min, dec_max):
+    return list(range(zone_of(max(dec_min, -90)),
+                      zone_of(min(dec_max, 90)) + 1))
+
+
+def ra_windows(ra_min, ra_max):
+    '''
+    Split an ra interval into at most two [lo, hi] windows inside
+    0h - 24h, ra_min > ra_max means the interval wraps through 0h.
+    '''
+    if ra_max - ra_min >= 24:
+        return [(0, 24)]
+    ra_min %= 24
+    ra_max %= 24
+    if ra_min <= ra_max:
+        return [(ra_min, ra_max)]
+    return [(ra_min, 24), (0, ra_max)]
+
+
+def cone_windows(ra, dec, radius):
+    '''
+    The zones and ra windows covering a cone of radius degrees
+    around ra, dec.  The windows are a superset of the cone, filter
+    the candidates with angular_separation.
+    '''
+    zones = zones_between(dec - radius, dec + radius)
+    if abs(dec) + radius >= 90:
+        # the cone covers a pole, every ra is in range
+        return zones, ra_windows(0, 24)
+    # widest ra half width, reached where the cone is furthest from the
+    # equator
+    half_width = asin(min(1, sin(radians(radius)) / cos(radians(dec)))) \
+        * 12 / np.pi
+    return zones, ra_windows(ra - half_width, ra + half_width)
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    '''
+    Great circle separation in degrees, accepts arrays
+    '''
+    ra1 = np.radians(np.asarray(ra1, dtype=float) * 15)
+    ra2 = np.radians(np.asarray(ra2, dtype=float) * 15)
+    dec1 = np.radians(np.asarray(dec1, dtype=float))
+    dec2 = np.radians(np.asarray(dec2, dtype=float))
+    cos_sep = np.sin(dec1) * np.sin(dec2) + \
+        np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return np.degrees(np.arccos(np.clip(cos_sep, -1, 1)))
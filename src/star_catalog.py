@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+
+class StarCatalog(object):
+    '''
+    A shared, read-only handle on the stars sqlite db.
+
+    Each thread gets one connection, opened read-only with a memory
+    map and a larger page cache, and reuses it for every query.
+    sqlite3 keeps the compiled statements of a connection keyed by
+    their SQL text, so the project's fixed queries are prepared once
+    per thread.
+    '''
+
+    def __init__(self, db_file, mmap_size=256 * 1024 * 1024,
+                 cache_kib=64 * 1024, cached_statements=256):
+        self.db_file = os.path.abspath(db_file)
+        self.mmap_size = mmap_size
+        self.cache_kib = cache_kib
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self):
+        uri = 'file:{}?mode=ro'.format(pathname2url(self.db_file))
+        # close() may run on another thread than the one that opened it
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute('PRAGMA mmap_size = {:d}'.format(self.mmap_size))
+        conn.execute('PRAGMA cache_size = -{:d}'.format(self.cache_kib))
+        return conn
+
+    def execute(self, sql, parameters=()):
+        return self.connection().execute(sql, parameters)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def open_catalog(star_db):
+    '''
+    Return the shared StarCatalog for a db file, star_db may already
+    be a StarCatalog.
+    '''
+    if isinstance(star_db, StarCatalog):
+        return star_db
+    key = os.path.abspath(star_db)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = StarCatalog(key)
+        return _catalogs[key]
+
+
+def close_catalogs():
+    with _catalogs_lock:
+        for catalog in _catalogs.values():
+            catalog.close()
+        _catalogs.clear()
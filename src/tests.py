@@ -1,6 +1,27 @@
+from math import radians
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
 import unittest
 
-from constellation import Constellation, ConstellationPoint
+import numpy as np
+
+import benchmarks
+from binary_catalog import write_binary_catalog
+from build_cache import BuildCache
+import constellation
+from constellation import (Constellation, ConstellationPoint,
+                           load_constellations, project_point, project_points)
+import instrumentation
+from mesh_export import STL_TRIANGLE_DTYPE, write_glb, write_stl
+from sky_zones import angular_separation, ra_windows, zone_of
+from star_catalog import close_catalogs
+from vrml_mesh import cylinder_mesh, merge_meshes, sphere_mesh
+from vrml_model import VRMLConstellationConnection, connection_geometry
+import vrml_templates
 
 
 class ConstellationTests(unittest.TestCase):
@@ -28,6 +49,346 @@ class ConstellationTests(unittest.TestCase):
         self.assertEqual(star_range[1], (1, 1000))
         self.assertEqual(star_range[2], (1,2))
 
+    def test_project_points_parity(self):
+        rng = np.random.RandomState(7)
+        ra = np.radians(rng.uniform(0, 360, 500))
+        dec = np.radians(rng.uniform(-90, 90, 500))
+        raC, decC = radians(80), radians(5)
+        # include stars opposite the center for the z1 < -.9 branch
+        ra[:10] = raC + np.pi + rng.uniform(-.1, .1, 10)
+        dec[:10] = -decC + rng.uniform(-.1, .1, 10)
+
+        projected = project_points(ra, dec, raC, decC)
+        expected = [project_point(r, d, raC, decC) for r, d in zip(ra, dec)]
+        np.testing.assert_allclose(projected, expected, rtol=1e-12, atol=1e-12)
+
+    def test_project_sets_stars(self):
+        test_con = Constellation('Ori', {})
+        test_con.add_star(ConstellationPoint(0, '', 'll', 5, -5, 1, ''))
+        test_con.add_star(ConstellationPoint(1, '', 'ul', 5, 10, 10, ''))
+        test_con.add_star(ConstellationPoint(2, '', 'ur', 6, 10, 100, ''))
+        projected = test_con.project()
+        raC, decC = radians(5.5 * 15), radians(2.5)
+        for row, star in zip(projected, test_con.stars.values()):
+            expected = project_point(radians(star.ra * 15), radians(star.dec),
+                                     raC, decC)
+            np.testing.assert_allclose(star.projected, expected)
+            np.testing.assert_allclose(row, expected)
+
+    def test_star_table_views(self):
+        test_con = Constellation('Ori', {})
+        star = ConstellationPoint(5, 'Bet Ori', 'Rigel', 5.24, -8.2, 264, .18)
+        test_con.add_star(star)
+        test_con.stars.extend([7, 9], [None, 'Del Ori'], ['Sol', None],
+                              [1, 2], [3, 4], [None, 10], [0, 1])
+        self.assertEqual(list(test_con.stars), [5, 7, 9])
+        self.assertEqual(test_con.get_star(9).key, 'Del Ori')
+        self.assertTrue(np.isnan(test_con.get_star(7).distance))
+        self.assertIsNone(test_con.get_star(7).projected)
+
+        # points are views, writes land in the constellation's table
+        star.projected = (1, 2)
+        np.testing.assert_array_equal(test_con.get_star(5).projected, [1, 2])
+        np.testing.assert_array_equal(test_con.get_star(5).get_xyz_ish(),
+                                      [1, 264, 2])
+
+        # re-adding an id replaces its row
+        test_con.add_star(ConstellationPoint(9, '', '', 2, 4, 11, 1))
+        self.assertEqual(len(test_con.stars), 3)
+        self.assertEqual(test_con.get_star(9).distance, 11)
+
+    def test_cached_bounds(self):
+        test_con = Constellation('Ori', {})
+        test_con.add_star(ConstellationPoint(0, '', 'll', 1, 1, 1, ''))
+        test_con.add_star(ConstellationPoint(1, '', 'ur', 2, 2, 10, ''))
+        self.assertEqual(test_con.find_center(), (1.5, 1.5))
+        test_con.stars.extend([2], [None], [None], [4], [-2], [5], [1])
+        self.assertEqual(test_con.find_center(), (2.5, 0))
+
+        test_con.project()
+        expected = np.array([np.min(test_con.stars.positions, axis=0),
+                             np.max(test_con.stars.positions, axis=0)])
+        np.testing.assert_array_equal(test_con.stars.position_bounds, expected)
+
+        # writes through a point invalidate the cached bounds
+        test_con.get_star(2).ra = 1.5
+        test_con.get_star(2).distance = 1000
+        self.assertEqual(test_con.find_center(), (1.5, 0))
+        self.assertEqual(test_con.get_range()[1], (1, 1000))
+
+
+class SkyZoneTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        count = 3000
+        self.ra = rng.uniform(0, 24, count)
+        self.dec = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+        self.mag = rng.uniform(-1, 8, count)
+
+        fd, self.db_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('''CREATE TABLE stars (id INTEGER PRIMARY KEY,
+            magnitude REAL, proper_name TEXT,
+            bayer_flamsteed_designation TEXT, ra REAL, dec REAL,
+            distance REAL, zone INT)''')
+        conn.executemany('INSERT INTO stars VALUES (?,?,?,?,?,?,?,?)',
+                         [(i, m, None, None, r, d, 10, zone_of(d))
+                          for i, (r, d, m) in
+                          enumerate(zip(self.ra, self.dec, self.mag))])
+        conn.execute('CREATE INDEX stars_zone_ra ON stars (zone, ra)')
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        close_catalogs()
+        os.remove(self.db_file)
+
+    def test_ra_windows(self):
+        self.assertEqual(ra_windows(2, 4), [(2, 4)])
+        self.assertEqual(ra_windows(23, 1), [(23, 24), (0, 1)])
+        self.assertEqual(ra_windows(-1, 1), [(23, 24), (0, 1)])
+        self.assertEqual(ra_windows(0, 30), [(0, 24)])
+
+    def test_cone_matches_scan(self):
+        for ra, dec, radius in [(5.5, 0, 10), (0.1, 30, 8), (12, 85, 10)]:
+            test_con = Constellation('Ori', {}, mag=5)
+            test_con.load_stars_in_cone(self.db_file, ra, dec, radius)
+            inside = (angular_separation(ra, dec, self.ra, self.dec) <= radius)
+            expected = np.nonzero(inside & (self.mag < 5))[0].tolist()
+            self.assertEqual(list(test_con.stars), expected)
+
+    def test_box_matches_scan(self):
+        test_con = Constellation('Ori', {}, mag=5)
+        test_con.load_stars_in_box(self.db_file, 22, 2, -20, 20)
+        inside = ((self.ra >= 22) | (self.ra <= 2)) & \
+            (self.dec >= -20) & (self.dec <= 20)
+        expected = np.nonzero(inside & (self.mag < 5))[0].tolist()
+        self.assertEqual(list(test_con.stars), expected)
+
+
+class BinaryCatalogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'stars.db')
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('''CREATE TABLE stars (id INTEGER PRIMARY KEY,
+            magnitude REAL, proper_name TEXT,
+            bayer_flamsteed_designation TEXT, ra REAL, dec REAL,
+            distance REAL, constellation TEXT)''')
+        rng = np.random.RandomState(5)
+        rows = []
+        for i in range(500):
+            rows.append((i, rng.choice([None, rng.uniform(-1, 9)]),
+                         rng.choice([None, 'Rigel']),
+                         rng.choice([None, 'Bet Ori']),
+                         rng.uniform(0, 24), rng.uniform(-90, 90),
+                         rng.choice([None, rng.uniform(1, 500)]),
+                         rng.choice([None, 'Ori', 'And'])))
+        conn.executemany('INSERT INTO stars VALUES (?,?,?,?,?,?,?,?)', rows)
+        conn.commit()
+        write_binary_catalog(conn, self.tmp_dir, batch_size=64)
+        conn.close()
+
+    def tearDown(self):
+        close_catalogs()
+        shutil.rmtree(self.tmp_dir)
+
+    def assertSameStars(self, a, b):
+        self.assertEqual(list(a.stars), list(b.stars))
+        self.assertEqual([s.key for s in a.stars.values()],
+                         [s.key for s in b.stars.values()])
+        np.testing.assert_array_equal(a.stars.angles, b.stars.angles)
+        np.testing.assert_array_equal(a.stars.positions, b.stars.positions)
+        np.testing.assert_array_equal(a.stars.magnitudes, b.stars.magnitudes)
+
+    def test_constellation_matches_sqlite(self):
+        for abbreviation in ('Ori', 'And', 'Cet'):
+            from_db = Constellation(abbreviation, {}, mag=5)
+            from_db.load_stars_from_sqlite(self.db_file)
+            from_binary = Constellation(abbreviation, {}, mag=5)
+            from_binary.load_stars_from_binary(self.tmp_dir)
+            self.assertSameStars(from_db, from_binary)
+
+    def test_selection_matches_sqlite(self):
+        selection = [17, 3, 499, 2000, 0]
+        from_db = Constellation('Ori', {})
+        from_db.load_stars_from_sqlite(self.db_file, selection=selection)
+        from_binary = Constellation('Ori', {})
+        from_binary.load_stars_from_binary(self.tmp_dir, selection=selection)
+        self.assertSameStars(from_db, from_binary)
+
+    def test_load_constellations_in_one_pass(self):
+        batch_size = constellation.LOAD_BATCH_SIZE
+        # small batches so constellations run across batch boundaries
+        constellation.LOAD_BATCH_SIZE = 7
+        try:
+            loaded = load_constellations(self.db_file, ['Ori', 'And', 'Cet'],
+                                         mag=5)
+            everything = load_constellations(self.db_file, mag=5)
+        finally:
+            constellation.LOAD_BATCH_SIZE = batch_size
+
+        self.assertEqual(set(everything), {'Ori', 'And'})
+        for abbreviation in ('Ori', 'And', 'Cet'):
+            from_db = Constellation(abbreviation, {}, mag=5)
+            from_db.load_stars_from_sqlite(self.db_file)
+            self.assertSameStars(from_db, loaded[abbreviation])
+            if abbreviation in everything:
+                self.assertSameStars(from_db, everything[abbreviation])
+
+    def test_large_selection(self):
+        # more ids than sqlite allows bound variables
+        selection = list(range(-40000, 1000, 2))
+        from_db = Constellation('Ori', {})
+        from_db.load_stars_from_sqlite(self.db_file, selection=selection)
+        self.assertEqual(list(from_db.stars), list(range(0, 500, 2)))
+        from_binary = Constellation('Ori', {})
+        from_binary.load_stars_from_binary(self.tmp_dir, selection=selection)
+        self.assertSameStars(from_db, from_binary)
+
+    def test_build_cache_round_trip(self):
+        cache = BuildCache(os.path.join(self.tmp_dir, 'cache'))
+        key = cache.stars_key(self.db_file, 'Ori', 5)
+        from_db = Constellation('Ori', {}, mag=5)
+        from_db.load_stars_from_sqlite(self.db_file)
+        from_db.project()
+        cache.store_stars(key, from_db)
+
+        from_cache = Constellation('Ori', {}, mag=5)
+        self.assertTrue(cache.load_stars(key, from_cache))
+        self.assertSameStars(from_db, from_cache)
+        np.testing.assert_array_equal(from_db.get_range(), from_cache.get_range())
+        self.assertFalse(cache.load_stars(cache.stars_key(self.db_file, 'Ori', 4),
+                                          Constellation('Ori', {}, mag=4)))
+
+
+class TemplateTests(unittest.TestCase):
+
+    def test_compiled_template(self):
+        compiled = vrml_templates.CompiledTemplate(
+            'T { at $x ${y} 100% $$ $name }', numeric=('x', 'y'),
+            float_format='.3f')
+        self.assertEqual(compiled.substitute(x=1, y=np.float64(2.5), name='a'),
+                         'T { at 1.000 2.500 100% $ a }')
+
+    def test_connection_geometry(self):
+        rng = np.random.RandomState(3)
+        p1, p2 = rng.uniform(-50, 50, (2, 20, 3))
+        midpoints, heights, rotations = connection_geometry(p1, p2)
+        np.testing.assert_allclose(midpoints, (p1 + p2) / 2)
+        direction = (p2 - p1) / heights[:, None]
+        np.testing.assert_allclose(np.linalg.norm(direction, axis=1), 1)
+
+        # a half turn about the axis takes the cylinder's Y to direction
+        axis = rotations[:, :3]
+        y = np.array([0, 1, 0])
+        turned = 2 * (axis @ y)[:, None] * axis / \
+            (axis ** 2).sum(axis=1)[:, None] - y
+        np.testing.assert_allclose(turned, direction, atol=1e-12)
+
+        batched = [c.get_vrml()
+                   for c in VRMLConstellationConnection.batch(p1, p2, 2)]
+        single = [VRMLConstellationConnection(a, b, 2).get_vrml()
+                  for a, b in zip(p1, p2)]
+        self.assertEqual(batched, single)
+
+    def test_star_sphere_matches_template(self):
+        rendered = vrml_templates.StarSphereTemplate.substitute(
+            x=1.5, y=-2, z=1e-7, radius=3)
+        expected = vrml_templates.Template(
+            vrml_templates.StarSphere).substitute(x=1.5, y=-2, z=1e-07,
+                                                  radius=3)
+        self.assertEqual(rendered, expected)
+
+
+class InstrumentationTests(unittest.TestCase):
+
+    def test_spans_and_counters(self):
+        # without a report the hooks do nothing
+        with instrumentation.span('load'):
+            instrumentation.count('stars', 3)
+
+        with instrumentation.build_report('test', verbose=False) as report:
+            for i in range(3):
+                with instrumentation.span('vrml'):
+                    with instrumentation.span('render'):
+                        instrumentation.count('elements', 10)
+        self.assertEqual(set(report.spans), {'vrml', 'vrml/render'})
+        self.assertEqual(report.spans['vrml/render']['calls'], 3)
+        self.assertEqual(report.counters, {'elements': 30})
+        self.assertGreaterEqual(report.seconds,
+                                report.spans['vrml']['seconds'])
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_pipeline_on_synthetic_catalog(self):
+        config = dict(benchmarks.CONFIG, constellations=4)
+        results = benchmarks.bench_pipeline(2000, config, memory=False)
+        self.assertEqual(list(results),
+                         ['ingest', 'load', 'project', 'scale', 'write'])
+        # about designated_fraction of the stars of one of 4 constellations
+        self.assertTrue(150 < results['load']['stars'] < 350)
+        self.assertGreater(results['write']['bytes'], 0)
+
+
+class MeshTests(unittest.TestCase):
+
+    def signed_volume(self, vertices, faces):
+        a, b, c = (vertices[faces[:, i]] for i in range(3))
+        return np.einsum('ij,ij->i', a, np.cross(b, c)).sum() / 6
+
+    def test_meshes_are_closed_and_outward(self):
+        spheres = sphere_mesh([[0, 0, 0], [10, 0, 0]], [1, 2],
+                              segments=64, rings=32)
+        cylinders = cylinder_mesh([[0, 0, 0], [1, 1, 1]],
+                                  [[0, 3, 0], [5, 1, 1]], [1, .5],
+                                  segments=64)
+        vertices, faces = merge_meshes([spheres, cylinders])
+
+        # every edge is shared by exactly two faces, in opposite directions
+        edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]],
+                                faces[:, [2, 0]]])
+        self.assertEqual(len(set(map(tuple, edges.tolist()))), len(edges))
+        self.assertEqual(set(map(tuple, edges.tolist())),
+                         set(map(tuple, edges[:, ::-1].tolist())))
+
+        expected = 4 / 3 * np.pi * 9 + np.pi * 3 + np.pi * .25 * 4
+        self.assertAlmostEqual(self.signed_volume(vertices, faces), expected,
+                               delta=expected * .01)
+
+    def test_stl_and_glb_export(self):
+        vertices, faces = sphere_mesh([[1, 2, 3]], 4)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            stl_file = os.path.join(tmp_dir, 'model.stl')
+            write_stl(stl_file, vertices, faces)
+            with open(stl_file, 'rb') as stl:
+                stl.seek(80)
+                count, = struct.unpack('<I', stl.read(4))
+                triangles = np.frombuffer(stl.read(), dtype=STL_TRIANGLE_DTYPE)
+            self.assertEqual(count, len(faces))
+            np.testing.assert_allclose(triangles['vertices'],
+                                       vertices[faces], rtol=1e-6)
+
+            glb_file = os.path.join(tmp_dir, 'model.glb')
+            write_glb(glb_file, vertices, faces)
+            with open(glb_file, 'rb') as glb:
+                data = glb.read()
+            magic, version, length = struct.unpack('<III', data[:12])
+            self.assertEqual((magic, version, length), (0x46546C67, 2, len(data)))
+            json_length, = struct.unpack('<I', data[12:16])
+            gltf = json.loads(data[20:20 + json_length].decode())
+            self.assertEqual(gltf['accessors'][0]['count'], len(vertices))
+            self.assertEqual(gltf['accessors'][1]['count'], faces.size)
+            np.testing.assert_allclose(gltf['accessors'][0]['max'],
+                                       [.005, .006, .007], rtol=1e-5)
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,25 +1,51 @@
-from string import Template
+from itertools import islice
+import os
 
 
+import instrumentation
 import vrml_templates
 import tempfile
 
 
 class VRMLCanvas(object):
 
-    def __init__(self):
+    def __init__(self, batch_size=2000, buffer_size=1024 * 1024):
         self.elements = []
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
 
     def add_element(self, new_element):
         self.elements.append(new_element)
 
-    def write_vrml(self, outfile, show_axes=False, header_values={}):
-        print ("Writing %s elements" % len(self.elements))
-        with open(outfile, 'w') as dest_file:
-            dest_file.write(Template(vrml_templates.Header).substitute(
+    def write_vrml(self, outfile, show_axes=False, header_values={},
+                   elements=None):
+        '''
+        elements, any iterable of elements such as a model's generator,
+        is written in place of the added elements so a streamed scene
+        is never held in memory.  Elements are rendered batch_size at a
+        time and each batch goes out in one write.
+        '''
+        if elements is None:
+            elements = self.elements
+        elements = iter(elements)
+        count = 0
+        with instrumentation.span('vrml'), \
+                open(outfile, 'w', buffering=self.buffer_size) as dest_file:
+            dest_file.write(vrml_templates.HeaderTemplate.substitute(
                              viewpoint_y=header_values['viewpoint_y']))
-            for e in self.elements:
-                dest_file.write(e.get_vrml())
+            while True:
+                # the models' element generators run inside render
+                with instrumentation.span('render'):
+                    batch = [e.get_vrml()
+                             for e in islice(elements, self.batch_size)]
+                if not batch:
+                    break
+                with instrumentation.span('write'):
+                    dest_file.write(''.join(batch))
+                count += len(batch)
             if show_axes:
                 print("writing axes")
                 dest_file.write(vrml_templates.DisplayAxes)
+        instrumentation.count('elements', count)
+        instrumentation.count('bytes written', os.path.getsize(outfile))
+        print ("Wrote %s elements" % count)
@@ -0,0 +1,120 @@
+'''
+Tessellate the model shapes with NumPy and merge them into one mesh.
+
+A mesh is a (vertices, faces) pair, vertices an (n, 3) float array
+and faces an (m, 3) int array of counter-clockwise (outward facing)
+triangles.  Every function builds all of its shapes at once by
+broadcasting one unit shape over the per-shape positions and sizes.
+'''
+
+import numpy as np
+
+from indicies import *
+
+
+def unit_sphere(segments=16, rings=8):
+    '''
+    A unit UV sphere around the origin, poles on the Y axis.
+    '''
+    theta = np.pi * np.arange(1, rings) / rings
+    phi = 2 * np.pi * np.arange(segments) / segments
+    ring_vertices = np.stack([np.outer(np.sin(theta), np.cos(phi)),
+                              np.repeat(np.cos(theta), segments)
+                              .reshape(rings - 1, segments),
+                              np.outer(np.sin(theta), np.sin(phi))], axis=-1)
+    vertices = np.concatenate([[[0, 1, 0]], ring_vertices.reshape(-1, 3),
+                               [[0, -1, 0]]])
+
+    bottom = len(vertices) - 1
+    j = np.arange(segments)
+    k = (j + 1) % segments
+    faces = [np.stack([np.zeros(segments, int), 1 + k, 1 + j], axis=1)]
+    for ring in range(rings - 2):
+        upper = 1 + ring * segments
+        lower = upper + segments
+        faces.append(np.stack([upper + j, upper + k, lower + k], axis=1))
+        faces.append(np.stack([upper + j, lower + k, lower + j], axis=1))
+    last = 1 + (rings - 2) * segments
+    faces.append(np.stack([np.full(segments, bottom), last + j, last + k],
+                          axis=1))
+    return vertices, np.concatenate(faces)
+
+
+def sphere_mesh(centers, radii, segments=16, rings=8):
+    '''
+    One sphere per center, radii is a scalar or one radius per center.
+    '''
+    centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+    radii = np.broadcast_to(np.asarray(radii, dtype=float), len(centers))
+    unit_vertices, unit_faces = unit_sphere(segments, rings)
+
+    vertices = centers[:, None, :] + \
+        radii[:, None, None] * unit_vertices[None, :, :]
+    faces = unit_faces[None, :, :] + \
+        (np.arange(len(centers)) * len(unit_vertices))[:, None, None]
+    return vertices.reshape(-1, 3), faces.reshape(-1, 3)
+
+
+def cylinder_mesh(p1, p2, radii, segments=16):
+    '''
+    One capped cylinder per pair of end points, radii is a scalar or
+    one radius per cylinder.
+    '''
+    p1 = np.asarray(p1, dtype=float).reshape(-1, 3)
+    p2 = np.asarray(p2, dtype=float).reshape(-1, 3)
+    count = len(p1)
+    radii = np.broadcast_to(np.asarray(radii, dtype=float), count)
+
+    axis = p2 - p1
+    length = np.linalg.norm(axis, axis=1)
+    direction = np.zeros_like(axis)
+    direction[:, PY] = 1
+    np.divide(axis, length[:, None], out=direction, where=length[:, None] > 0)
+
+    # (u, v, direction) is a right handed basis for every cylinder
+    helper = np.zeros_like(axis)
+    mostly_x = np.abs(direction[:, PX]) > .9
+    helper[~mostly_x, PX] = 1
+    helper[mostly_x, PY] = 1
+    u = np.cross(direction, helper)
+    u /= np.linalg.norm(u, axis=1)[:, None]
+    v = np.cross(direction, u)
+
+    phi = 2 * np.pi * np.arange(segments) / segments
+    ring = np.cos(phi)[None, :, None] * u[:, None, :] + \
+        np.sin(phi)[None, :, None] * v[:, None, :]
+    ring *= radii[:, None, None]
+
+    # per cylinder: bottom ring, top ring, bottom center, top center
+    vertices = np.concatenate([p1[:, None, :] + ring,
+                               p2[:, None, :] + ring,
+                               p1[:, None, :],
+                               p2[:, None, :]], axis=1)
+
+    j = np.arange(segments)
+    k = (j + 1) % segments
+    top = segments + j
+    top_next = segments + k
+    bottom_center = np.full(segments, 2 * segments)
+    top_center = bottom_center + 1
+    unit_faces = np.concatenate([
+        np.stack([j, k, top_next], axis=1),
+        np.stack([j, top_next, top], axis=1),
+        np.stack([bottom_center, k, j], axis=1),
+        np.stack([top_center, top, top_next], axis=1)])
+
+    faces = unit_faces[None, :, :] + \
+        (np.arange(count) * (2 * segments + 2))[:, None, None]
+    return vertices.reshape(-1, 3), faces.reshape(-1, 3)
+
+
+def merge_meshes(meshes):
+    '''
+    Combine meshes into one, offsetting each mesh's face indices.
+    '''
+    meshes = list(meshes)
+    offsets = np.cumsum([0] + [len(m[0]) for m in meshes[:-1]])
+    vertices = np.concatenate([m[0] for m in meshes])
+    faces = np.concatenate([m[1] + offset
+                            for m, offset in zip(meshes, offsets)])
+    return vertices, faces
@@ -1,12 +1,15 @@
 import math
-from string import Template
 # from util import DotDict
 
 import numpy as np
 
 from indicies import *
+from instrumentation import count, span
+from mesh_export import write_glb, write_stl
 from vrml_canvas import VRMLCanvas
+from vrml_mesh import cylinder_mesh, merge_meshes, sphere_mesh
 import vrml_templates
+from vrml_utils import face_index_text, mesh_points_text
 
 
 class ModelConfig(object):
@@ -16,14 +19,20 @@ class ModelConfig(object):
         self.preserve_aspect_ratio = True
         self.min_thickness_mm = [3, 3, 3]
         self.connection_thickness = 10
+        # level of detail for starfields, None draws every star in full,
+        # otherwise only the n brightest and the rest switch to a coarse
+        # sphere past lod_range_mm from the viewer
+        self.lod_full_detail_stars = None
+        self.lod_range_mm = 150
 
 
 class VRMLStar(object):
 
-    def __init__(self, star, scalar=[1, 1, 1], radius=1):
+    def __init__(self, star, scalar=[1, 1, 1], radius=1, lod_range=None):
         self.star = star
         self.scalar = scalar
         self.radius = radius
+        self.lod_range = lod_range
         self.overridden = [False, False, False]
         self.override = [0, 0, 0]
 
@@ -38,7 +47,11 @@ class VRMLStar(object):
         else:
             y = self.star.distance * self.scalar[PY]
         z = self.star.projected[PY] * self.scalar[PZ]
-        star_vrml = Template(vrml_templates.StarSphere).substitute(
+        if self.lod_range is not None:
+            return vrml_templates.StarSphereLODTemplate.substitute(
+                x=x, y=y, z=z, radius=self.radius,
+                range=self.lod_range / self.radius)
+        star_vrml = vrml_templates.StarSphereTemplate.substitute(
             x=x, y=y, z=z, radius=self.radius)
 
         return star_vrml
@@ -66,14 +79,58 @@ class ConstellationStarfieldModel(object):
 
         return [x_scalar, distance_scalar, z_scalar]
 
-    def build_vrml(self):
-        canvas = VRMLCanvas()
+    def get_model_positions(self, star_scalar):
+        '''
+        (n, 3) model coordinates of every star, in self.constellation.stars order
+        '''
+        return self.constellation.stars.positions * np.asarray(star_scalar)
+
+    def iter_elements(self):
         star_scalar = self.get_star_scalar()
-        for star in self.constellation.stars.values():
-            canvas.add_element(VRMLStar(star, star_scalar))
+        full_detail = self.model_config.lod_full_detail_stars
+        if full_detail is None:
+            for star in self.constellation.stars.values():
+                yield VRMLStar(star, star_scalar)
+            return
+
+        # brightest first, faint stars past the cut get an LOD node
+        for i, star in enumerate(self.constellation.get_stars_by_magnitude()):
+            lod_range = None if i < full_detail else self.model_config.lod_range_mm
+            yield VRMLStar(star, star_scalar, lod_range=lod_range)
 
+    def iter_mesh_elements(self):
+        yield VRMLMesh(*self.build_mesh(), comment=self.__class__.__name__)
+
+    def build_mesh(self):
+        '''
+        The model tessellated into one mesh, (vertices, faces)
+        '''
+        positions = self.get_model_positions(self.get_star_scalar())
+        return sphere_mesh(positions, 1)
+
+    def export_stl(self, outfile):
+        with span('mesh'):
+            vertices, faces = self.build_mesh()
+        with span('export'):
+            write_stl(outfile, vertices, faces)
+        count('triangles', len(faces))
+
+    def export_glb(self, outfile):
+        with span('mesh'):
+            vertices, faces = self.build_mesh()
+        with span('export'):
+            write_glb(outfile, vertices, faces, name=self.constellation.abbreviation)
+        count('triangles', len(faces))
+
+    def build_vrml(self, mesh=False):
+        '''
+        mesh writes the model as one merged IndexedFaceSet in place of
+        a node per star and connection
+        '''
+        canvas = VRMLCanvas()
         canvas.write_vrml(self.output_filename, show_axes=False,
-                          header_values={'viewpoint_y': 2 * self.model_config.size_mm[PY]})
+                          header_values={'viewpoint_y': 2 * self.model_config.size_mm[PY]},
+                          elements=self.iter_mesh_elements() if mesh else self.iter_elements())
 
 
 class VRMLStarPillar(VRMLStar):
@@ -86,7 +143,7 @@ class VRMLStarPillar(VRMLStar):
         star_spot = self.star.get_xyz_ish()
         height = self.backplane - (star_spot[PY] * self.scalar[PY])
         radius = 1
-        pillar_vrml = Template(vrml_templates.StarPillar).substitute(
+        pillar_vrml = vrml_templates.StarPillarTemplate.substitute(
             x=star_spot[PX] * self.scalar[PX],
             y=star_spot[PY] * self.scalar[PY] + height / 2.0,
 
@@ -95,54 +152,108 @@ class VRMLStarPillar(VRMLStar):
         return pillar_vrml
 
 
+def connection_geometry(p1, p2):
+    '''
+    Midpoints (n, 3), lengths (n,) and VRML rotations (n, 4) of the
+    cylinders joining each row of the (n, 3) end point arrays.
+
+    The rotation axis is halfway between the cylinder's Y axis and
+    the connection's direction, a half turn about it lines them up.
+    '''
+    p1 = np.asarray(p1, dtype=float).reshape(-1, 3)
+    p2 = np.asarray(p2, dtype=float).reshape(-1, 3)
+    midpoints = (p1 + p2) / 2
+    heights = np.linalg.norm(p1 - p2, axis=1)
+    rotations = np.empty((len(p1), 4))
+    rotations[:, :3] = (p2 - p1) / heights[:, None]
+    rotations[:, PY] += 1
+    rotations[:, 3] = 3.1415
+    return midpoints, heights, rotations
+
+
 class VRMLConstellationConnection(object):
 
-    def __init__(self, p1, p2, radius=1):
+    def __init__(self, p1, p2, radius=1, geometry=None):
         '''
         p1, p2, the model coordinates of the endpints for the connection
+        geometry, its (midpoint, height, rotation) if already computed
         '''
         self.p1 = np.array(p1)
         self.p2 = np.array(p2)
         self.radius = radius
+        self.geometry = geometry
 
-    def _get_full_rot_quad(self, height):
-        xr = (self.p2[PX] - self.p1[PX]) / height
-        yr = 1 + (self.p2[PY] - self.p1[PY]) / height
-        zr = (self.p2[PZ] - self.p1[PZ]) / height
-        ar = 3.1415
-        quad = "{} {} {} {}".format(xr, yr, zr, ar)
-        return quad
+    @classmethod
+    def batch(cls, p1, p2, radius=1):
+        '''
+        One connection per row of the (n, 3) end point arrays, with the
+        geometry of all of them computed in one pass.
+        '''
+        midpoints, heights, rotations = connection_geometry(p1, p2)
+        for a, b, geometry in zip(p1, p2, zip(midpoints.tolist(),
+                                                heights.tolist(),
+                                                rotations.tolist())):
+            yield cls(a, b, radius, geometry)
 
     def get_vrml(self):
-        midpoint = (self.p1 + self.p2) / 2
-        height = np.linalg.norm(self.p1 - self.p2)
-        rot_quad = self._get_full_rot_quad(height)
-        connection_vrml = Template(vrml_templates.StarConnection).substitute(
-            height=height, radius=self.radius, tx=midpoint[PX], ty=midpoint[PY], tz=midpoint[PZ], rot_quad=rot_quad)
+        if self.geometry is None:
+            midpoints, heights, rotations = connection_geometry(self.p1, self.p2)
+            self.geometry = midpoints[0], heights[0], rotations[0]
+        midpoint, height, rotation = self.geometry
+        connection_vrml = vrml_templates.StarConnectionTemplate.substitute(
+            height=height, radius=self.radius, tx=midpoint[PX], ty=midpoint[PY], tz=midpoint[PZ],
+            rx=rotation[0], ry=rotation[1], rz=rotation[2], angle=rotation[3])
         return connection_vrml
-        # return connection_vrml
+
+
+class VRMLMesh(object):
+
+    def __init__(self, vertices, faces, comment=''):
+        '''
+        vertices (n, 3) and faces (m, 3) of counter-clockwise triangles
+        '''
+        self.vertices = vertices
+        self.faces = faces
+        self.comment = comment
+
+    def get_vrml(self):
+        return vrml_templates.IndexedFaceSetTemplate.substitute(
+            comment=self.comment, convex='TRUE', solid='TRUE', ccw='TRUE',
+            points=mesh_points_text(self.vertices),
+            coordinates=face_index_text(self.faces))
 
 
 class ConstellationPillarModel(ConstellationStarfieldModel):
 
-    def build_vrml(self):
-        canvas = VRMLCanvas()
-        star_scalar = self.get_star_scalar()
-        # star_scalar = [20,20,20]
+    def get_depth(self, star_scalar):
         field_range = self.constellation.get_range()
         depth = field_range[PY][1] * star_scalar[PY] - \
             (.5 * self.model_config.connection_thickness)
         print('depth', depth)
+        return depth
+
+    def iter_elements(self):
+        star_scalar = self.get_star_scalar()
+        # star_scalar = [20,20,20]
+        depth = self.get_depth(star_scalar)
 
-        x = 0
         for star in self.constellation.stars.values():
-            canvas.add_element(VRMLStar(star, star_scalar, radius=1))
-            canvas.add_element(
-                VRMLStarPillar(star, star_scalar, radius=1, backplane=depth))
-            x += 1
+            yield VRMLStar(star, star_scalar, radius=1)
+            yield VRMLStarPillar(star, star_scalar, radius=1, backplane=depth)
 
+    def build_mesh(self):
+        star_scalar = self.get_star_scalar()
+        positions = self.get_model_positions(star_scalar)
+        backplane = positions.copy()
+        backplane[:, PY] = self.get_depth(star_scalar)
+        return merge_meshes([sphere_mesh(positions, 1),
+                             cylinder_mesh(positions, backplane, 1)])
+
+    def build_vrml(self, mesh=False):
+        canvas = VRMLCanvas()
         canvas.write_vrml(self.output_filename, show_axes=True,
-                          header_values={'viewpoint_y': 2 * self.model_config.size_mm[PY]})
+                          header_values={'viewpoint_y': 2 * self.model_config.size_mm[PY]},
+                          elements=self.iter_mesh_elements() if mesh else self.iter_elements())
 
 
 class ConstellationStackedModel(ConstellationStarfieldModel):
@@ -178,7 +289,7 @@ class ConstellationStackedModel(ConstellationStarfieldModel):
 
         return np.array([x_scalar, distance_scalar, z_scalar])
 
-    def build_vrml(self):
+    def configure(self):
         self.model_config.size_mm = [100, 60, 100]
         self.model_config.base_star_radius = 3
         self.model_config.base_connection_radius = 3
@@ -187,7 +298,31 @@ class ConstellationStackedModel(ConstellationStarfieldModel):
         self.model_config.pillar_radius = 1
         self.model_config.base_star_sep = 3
 
-        canvas = VRMLCanvas()
+    def build_vrml(self, mesh=False):
+        self.configure()
+        super().build_vrml(mesh)
+
+    def build_mesh(self):
+        self.configure()
+        config = self.model_config
+        star_scalar = self.get_star_scalar()
+        base_depth = config.size_mm[PY] - config.base_star_radius
+
+        top = self.get_model_positions(star_scalar)
+        base = top.copy()
+        base[:, PY] = base_depth
+        ends = self.constellation.get_connection_rows()
+
+        return merge_meshes([
+            sphere_mesh(top, config.star_radius),
+            sphere_mesh(base, config.base_star_radius),
+            cylinder_mesh(top, base, config.pillar_radius),
+            cylinder_mesh(top[ends[:, 0]], top[ends[:, 1]],
+                          config.star_connection_radius),
+            cylinder_mesh(base[ends[:, 0]], base[ends[:, 1]],
+                          config.base_connection_radius)])
+
+    def iter_elements(self):
         star_scalar = self.get_star_scalar()
         field_range = self.constellation.get_range()
         base_depth = self.model_config.size_mm[
@@ -195,35 +330,27 @@ class ConstellationStackedModel(ConstellationStarfieldModel):
 
         x = 0
         for star in self.constellation.stars.values():
-            canvas.add_element(
-                VRMLStar(star, star_scalar, radius=self.model_config.star_radius, ))
+            yield VRMLStar(star, star_scalar, radius=self.model_config.star_radius)
             base_star = VRMLStar(
                 star, star_scalar, radius=self.model_config.base_star_radius)
             base_star.override_y(base_depth)
-            canvas.add_element(base_star)
-            canvas.add_element(
-                VRMLStarPillar(star, star_scalar, radius=self.model_config.pillar_radius,
-                backplane=base_depth))
-
-        for connection in self.constellation.connections:
-            s1, s2 = self.constellation.get_connection_stars(connection)
-            sp1 = s1.get_xyz_ish() * star_scalar
-            sp2 = s2.get_xyz_ish() * star_scalar
-            canvas.add_element(VRMLConstellationConnection(
-                sp1, sp2, self.model_config.star_connection_radius))
-
-            p1, p2 = self.constellation.get_connection_positions(connection)
-
-            p1 = [p1[0] * star_scalar[PX],
-                  base_depth,
-                  p1[1] * star_scalar[PZ]
-                  ]
-            p2 = [p2[0] * star_scalar[PX],
-                  base_depth,
-                  p2[1] * star_scalar[PZ]
-                  ]
-            canvas.add_element(VRMLConstellationConnection(
-                p1, p2, self.model_config.base_connection_radius))
+            yield base_star
+            yield VRMLStarPillar(star, star_scalar, radius=self.model_config.pillar_radius,
+                                 backplane=base_depth)
+
+        # each connection is drawn at the stars and again on the base
+        top = self.get_model_positions(star_scalar)
+        base = top.copy()
+        base[:, PY] = base_depth
+        ends = self.constellation.get_connection_rows()
+        star_lines = VRMLConstellationConnection.batch(
+            top[ends[:, 0]], top[ends[:, 1]],
+            self.model_config.star_connection_radius)
+        base_lines = VRMLConstellationConnection.batch(
+            base[ends[:, 0]], base[ends[:, 1]],
+            self.model_config.base_connection_radius)
+        for star_line, base_line in zip(star_lines, base_lines):
+            yield star_line
+            yield base_line
+
 
-        canvas.write_vrml(self.output_filename, show_axes=False,
-                          header_values={'viewpoint_y': 2 * self.model_config.size_mm[PY]})
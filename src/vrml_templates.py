@@ -1,6 +1,9 @@
 
 
 
+from string import Template
+
+
 Header  = '''#VRML V2.0 utf8
  Viewpoint {
           position    0 -$viewpoint_y 0	#the camera positioned to X=0, Y=0 and Z=10
@@ -12,19 +15,55 @@ WorldInfo {
     title "Coterie"
     info  [ "Depth" ]
 }
+
+# shared nodes, DEFed once and never drawn, every element USEs them
+# scaled to its size
+Switch {
+    whichChoice -1
+    choice [
+        DEF StarAppearance Appearance {
+            material Material { }
+        }
+        DEF UnitSphere Shape {
+            appearance USE StarAppearance
+            geometry Sphere { radius 1 }
+        }
+        DEF UnitCylinder Shape {
+            appearance USE StarAppearance
+            geometry Cylinder { height 1 radius 1 }
+        }
+        # octahedron stand in for distant faint stars
+        DEF CoarseSphere Shape {
+            appearance USE StarAppearance
+            geometry IndexedFaceSet {
+                coord Coordinate {
+                    point [ 1 0 0, -1 0 0, 0 1 0, 0 -1 0, 0 0 1, 0 0 -1 ]
+                }
+                coordIndex [ 0 2 4 -1, 2 1 4 -1, 1 3 4 -1, 3 0 4 -1,
+                             2 0 5 -1, 1 2 5 -1, 3 1 5 -1, 0 3 5 -1 ]
+            }
+        }
+    ]
+}
 '''
 
 StarSphere = '''
 Transform {
     translation $x $y $z
-    children[
-        Shape{
-            appearance Appearance{
-                material Material { }
-            }
-            geometry Sphere {
-                radius  $radius  #radius in units
-            }
+    scale $radius $radius $radius
+    children [ USE UnitSphere ]
+}
+'''
+
+# the LOD range is in the Transform's scaled units, world range / radius
+StarSphereLOD = '''
+Transform {
+    translation $x $y $z
+    scale $radius $radius $radius
+    children [
+        LOD {
+            range [ $range ]
+            level [ USE UnitSphere USE CoarseSphere ]
         }
     ]
 }
@@ -33,36 +72,18 @@ Transform {
 StarPillar = '''
 Transform {
     translation $x $y $z
-    children[
-        Shape{
-            appearance Appearance{
-                material Material { }
-            }
-            geometry Cylinder {
-                height $height
-                radius $radius
-            }
-        }
-    ]
+    scale $radius $height $radius
+    children [ USE UnitCylinder ]
 }
 '''
 
 StarConnection = '''
 Transform {
     translation $tx $ty $tz
-    rotation $rot_quad
-        children [
-            Shape{
-                appearance Appearance{
-                    material Material { }
-                }
-                geometry Cylinder {
-                    height $height
-                    radius $radius
-                }
-            }
-        ]
-    }
+    rotation $rx $ry $rz $angle
+    scale $radius $height $radius
+    children [ USE UnitCylinder ]
+}
 '''
 
 
@@ -214,3 +235,44 @@ Transform {
 
 Shape {geometry Sphere{}}
 '''
+
+
+class CompiledTemplate(object):
+    '''
+    A $field template parsed once into a %-format string, rendering
+    is then a single % operation instead of a Template substitution.
+    Fields listed in numeric are written with float_format, the rest
+    with %s.
+    '''
+
+    def __init__(self, source, numeric=(), float_format='.6g'):
+        self.source = source
+        self.numeric = set(numeric)
+
+        def field(match):
+            if match.group('escaped') is not None:
+                return '$'
+            name = match.group('named') or match.group('braced')
+            if name is None:
+                raise ValueError('Invalid placeholder in template')
+            if name in self.numeric:
+                return '%({}){}'.format(name, float_format)
+            return '%({})s'.format(name)
+
+        self.format = Template.pattern.sub(field, source.replace('%', '%%'))
+
+    def substitute(self, **values):
+        return self.format % values
+
+
+HeaderTemplate = CompiledTemplate(Header, numeric=('viewpoint_y',))
+StarSphereTemplate = CompiledTemplate(
+    StarSphere, numeric=('x', 'y', 'z', 'radius'))
+StarSphereLODTemplate = CompiledTemplate(
+    StarSphereLOD, numeric=('x', 'y', 'z', 'radius', 'range'))
+StarPillarTemplate = CompiledTemplate(
+    StarPillar, numeric=('x', 'y', 'z', 'radius', 'height'))
+StarConnectionTemplate = CompiledTemplate(
+    StarConnection,
+    numeric=('tx', 'ty', 'tz', 'rx', 'ry', 'rz', 'angle', 'radius', 'height'))
+IndexedFaceSetTemplate = CompiledTemplate(IndexedFaceSet)
@@ -2,3 +2,12 @@ from indicies import *
 
 def points_to_text(points):
     return "\n".join([" ".join([str(p[PX]), str(p[PZ]), str(-1*p[PY])]) for p in points])
+
+
+def mesh_points_text(vertices, float_format='%.6g'):
+    row = ' '.join([float_format] * 3)
+    return ',\n'.join(row % tuple(v) for v in vertices.tolist())
+
+
+def face_index_text(faces):
+    return ',\n'.join('%d %d %d -1' % tuple(f) for f in faces.tolist())